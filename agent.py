@@ -2,38 +2,106 @@ import os
 import json
 import time
 import re
+import random
 import pickle 
 import requests
 import sqlite3
+import joblib
+import numpy as np
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
 import google.generativeai as genai
 from dotenv import load_dotenv
+try:
+    import orjson  # Opcional: parseo/serialización JSON más rápidos
+except ImportError:
+    orjson = None
 
-from database import add_opportunity, get_all_opportunity_urls, get_all_feedback_examples, get_recent_opportunities, add_pending_article, add_ai_rejected_article, get_pending_articles, clear_pending_articles
+from database import get_all_opportunity_urls, get_all_feedback_examples, get_recent_opportunities, get_pending_articles, clear_pending_articles, PendingWrites
 from slack_notifier import send_slack_notification
 from scrapers import scrape_glassdoor_jobs
 from knowledge_extractor import load_distilled_rules, format_rules_for_prompt
-from deduplicator import is_duplicate_opportunity, extract_key_entities
-from semantic_filter import semantic_pre_filter, add_positive_example, add_negative_example, get_training_stats, batch_filter_articles
+from deduplicator import is_duplicate_opportunity, extract_key_entities, RecentOpportunityIndex
+from semantic_filter import semantic_pre_filter, semantic_pre_filter_batch, add_positive_example, add_negative_example, get_training_stats, batch_filter_articles, warm_up_async
 
 load_dotenv()
 genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 
+def json_loads(data):
+    """json.loads con orjson si está instalado (acepta str o bytes)."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    """json.dumps con orjson si está instalado; siempre devuelve str (SQLite/Slack)."""
+    return orjson.dumps(obj).decode('utf-8') if orjson else json.dumps(obj)
+
 # =============================================================================
 # API COST CONTROL CONFIG - UPDATE THIS SECTION WHEN MODELS/LIMITS CHANGE
 # =============================================================================
 MODEL_ROTATION = [
-    {"name": "gemini-3-flash-preview",  "limit": 20},  # Works! 5 RPM, 20 RPD
-    {"name": "gemini-2.5-flash",        "limit": 20},  # 5 RPM, 20 RPD
-    {"name": "gemini-2.5-flash-lite",   "limit": 20},  # 10 RPM, 20 RPD
-    {"name": "gemini-2.0-flash",        "limit": 20},  # 10 RPM, 20 RPD
-    {"name": "gemini-2.0-flash-lite",   "limit": 20},  # 10 RPM, 20 RPD
+    {"name": "gemini-3-flash-preview",  "limit": 20, "rpm": 5},   # Works! 5 RPM, 20 RPD
+    {"name": "gemini-2.5-flash",        "limit": 20, "rpm": 5},   # 5 RPM, 20 RPD
+    {"name": "gemini-2.5-flash-lite",   "limit": 20, "rpm": 10},  # 10 RPM, 20 RPD
+    {"name": "gemini-2.0-flash",        "limit": 20, "rpm": 10},  # 10 RPM, 20 RPD
+    {"name": "gemini-2.0-flash-lite",   "limit": 20, "rpm": 10},  # 10 RPM, 20 RPD
 ]
 RATE_LIMIT_SLEEP = 15  # seconds between API calls (5 RPM = need 12s, using 15s for safety)
+RATE_LIMIT_SAFETY = 0.8  # Fracción del RPM real que usamos (5 RPM -> un hueco cada 15s, como RATE_LIMIT_SLEEP)
 ML_FILTER_THRESHOLD = 0.50  # 50% = neutral score (equally similar to pos and neg)
+SEMANTIC_HARD_REJECT = 0.30  # Por debajo: descarte definitivo (se guarda la URL para no volver a puntuarla)
 TOTAL_DAILY_LIMIT = sum(m["limit"] for m in MODEL_ROTATION)  # Auto-calculated: 100
+# MODEL_SCHEDULE[i] = modelo a usar en la llamada i (precalculado: sin recorrer la rotación por item)
+MODEL_SCHEDULE = [m["name"] for m in MODEL_ROTATION for _ in range(m["limit"])]
+ANALYSIS_BATCH_SIZE = 5  # Textos analizados por llamada a Gemini (1 llamada del presupuesto por lote)
 # =============================================================================
 
+# --- NEWSDATA.IO CONFIG ---
+NEWS_API_URL = "https://newsdata.io/api/1/news"
+NEWS_FETCH_WORKERS = 4  # Peticiones concurrentes en vuelo
+NEWS_REQUESTS_PER_MINUTE = 2  # Equivale a la antigua pausa de 30s; subir si el plan lo permite
+NEWS_MAX_RETRIES = 3  # Reintentos ante HTTP 429
+NEWS_RETRY_BASE_DELAY = 30  # segundos (backoff exponencial con jitter)
+
+
+class Item(NamedTuple):
+    """
+    Item recolectado (noticia o vacante) pendiente de filtrar/analizar.
+    NamedTuple en lugar de dict: sin __dict__ por instancia y acceso por atributo.
+    """
+    source_url: str
+    content: str
+    source_type: str
+    country: Optional[str] = None
+    headline: str = ""
+
+
+class TokenBucket:
+    """
+    Limitador de ritmo basado en reloj monotónico (thread-safe).
+    Solo duerme lo necesario hasta el siguiente hueco libre, en lugar de
+    una pausa fija después de cada petición.
+    """
+    def __init__(self, rate_per_minute):
+        self.interval = 60.0 / rate_per_minute
+        self.next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Un token bucket por modelo con su RPM real: solo se espera lo que falte desde la última llamada
+MODEL_RATE_LIMITERS = {m["name"]: TokenBucket(m["rpm"] * RATE_LIMIT_SAFETY) for m in MODEL_ROTATION}
+
 
 # --- CONTEXTO ESTRATÉGICO DETALLADO DE IGENERIS ---
 IGENERIS_CONTEXT = """
@@ -61,108 +129,267 @@ IGENERIS_CONTEXT = """
 """
 
 # --- FUNCIÓN DE RECOLECCIÓN DE NOTICIAS ---
+def canonicalize_url(url):
+    """
+    Normaliza una URL para deduplicar: esquema y host en minúsculas,
+    sin fragmento ni parámetros de tracking (utm_*). El resto de la query se
+    deja tal cual (sin recodificar), y es idempotente: se aplica igual a las
+    URLs nuevas y a las ya guardadas.
+    """
+    parts = urlsplit(url.strip())
+    query = '&'.join(param for param in parts.query.split('&')
+                     if param and not param.split('=', 1)[0].lower().startswith('utm_'))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+def flatten_trigger_lexicon(trigger_lexicon):
+    """Palabras clave del trigger_lexicon (categoría -> idioma -> lista), sin duplicados y en orden."""
+    # dict keyed por minúsculas deduplica sin distinguir mayúsculas manteniendo el orden del config
+    return tuple({kw.strip().lower(): kw.strip() for category in trigger_lexicon.values() for lang in category.values() for kw in lang}.values())
+
+def build_query_plan(keywords, country_tiers):
+    """
+    Construye la lista de consultas (grupo de países, keyword) sin repeticiones.
+    Un país que aparece en varios Tiers solo se consulta en el primero.
+    """
+    covered = set()
+    groups = []
+    for tier in country_tiers:
+        countries = [c for c in dict.fromkeys(c.strip().lower() for c in tier.split(',')) if c and c not in covered]
+        covered.update(countries)
+        if countries:
+            groups.append(','.join(countries))
+    return list(dict.fromkeys((group, keyword) for group in groups for keyword in keywords))
+
+class CompiledConfig(NamedTuple):
+    """
+    config.json precalculado una sola vez al arrancar: keywords aplanadas,
+    Tiers ya partidos y plan de consultas.
+    El dict original se conserva en `raw`.
+    """
+    raw: dict
+    keywords: tuple
+    tier_countries: tuple  # Un tuple de países por Tier, en orden
+    query_plan: tuple  # (grupo de países, keyword) para newsdata.io
+    news_enabled: bool
+    jobs_enabled: bool
+    job_titles: tuple
+
+def compile_config(config):
+    """Construye un CompiledConfig a partir del dict de config.json (idempotente)."""
+    if isinstance(config, CompiledConfig):
+        return config
+    keywords = flatten_trigger_lexicon(config.get("trigger_lexicon", {}))
+    tiers = list(config.get("search_tiers", {}).values())
+    data_sources = config.get("data_sources", {})
+    return CompiledConfig(
+        raw=config,
+        keywords=keywords,
+        tier_countries=tuple(tuple(c.strip() for c in tier.split(',') if c.strip()) for tier in tiers),
+        query_plan=tuple(build_query_plan(keywords, tiers)),
+        news_enabled=data_sources.get("news_api", {}).get("enabled", False),
+        jobs_enabled=data_sources.get("job_portals", {}).get("enabled", False),
+        job_titles=tuple(config.get("job_monitoring", {}).get("target_job_titles", [])),
+    )
+
+def _fetch_newsdata(session, api_key, keyword, group, bucket):
+    """
+    Ejecuta una consulta a newsdata.io respetando el token bucket compartido.
+    Ante HTTP 429 reintenta con backoff exponencial y jitter.
+    """
+    print(f"  - Consultando para keyword '{keyword}' ({group})...", flush=True)
+    params = {"apikey": api_key, "q": keyword, "country": group, "language": "es,en"}
+    retry_delay = NEWS_RETRY_BASE_DELAY
+
+    for attempt in range(NEWS_MAX_RETRIES):
+        bucket.acquire()
+        response = session.get(NEWS_API_URL, params=params, timeout=30)
+        if response.status_code == 429 and attempt < NEWS_MAX_RETRIES - 1:
+            wait = retry_delay + random.uniform(0, retry_delay)
+            print(f"    -> Rate limit (429) para '{keyword}'. Reintentando en {wait:.0f}s...", flush=True)
+            time.sleep(wait)
+            retry_delay *= 2
+            continue
+        response.raise_for_status()
+        return response.json().get('results', [])
+    return []
+
 def get_news_from_newsdata(config):
     """
     Obtiene noticias de la API newsdata.io usando la jerarquía de Tiers definida en config.json.
+    Las consultas (tier, keyword) se lanzan en paralelo con un límite de ritmo compartido.
     """
     print(" -> Buscando noticias (estrategia jerárquica por Tiers)...", flush=True)
-    all_articles = []
-    seen_urls = set()
+    articles_by_url = {}  # URL canónica -> artículo (conserva el orden de inserción)
 
     api_key = os.environ.get("NEWS_API_KEY_V2")
     if not api_key:
         print("   -> ERROR: No se encontró la variable de entorno NEWS_API_KEY_V2.")
         return []
 
-    trigger_lexicon = config.get("trigger_lexicon", {})
-    keywords = {kw for category in trigger_lexicon.values() for lang in category.values() for kw in lang}
+    config = compile_config(config)
+    print(f"   -> Buscando {len(config.keywords)} palabras clave en {len(config.tier_countries)} Tiers de países.")
 
-    country_tiers = config.get("search_tiers", {}).values()
+    jobs = config.query_plan
+    print(f"   -> Plan de consultas: {len(jobs)} peticiones únicas.")
+    bucket = TokenBucket(NEWS_REQUESTS_PER_MINUTE)
 
-    print(f"   -> Buscando {len(keywords)} palabras clave en {len(country_tiers)} Tiers de países.")
+    # Una sola sesión para todo el ciclo: reutiliza conexiones TCP/TLS con newsdata.io.
+    # El pool se dimensiona al número de workers para que ninguno abra conexiones extra.
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=NEWS_FETCH_WORKERS)
 
-    for group in country_tiers:
-        print(f"\n--- Buscando en el Tier de países: {group} ---", flush=True)
-        for keyword in list(keywords):
-            try:
-                print(f"  - Consultando para keyword '{keyword}'...", flush=True)
-                query = requests.utils.quote(keyword)
-                url = f"https://newsdata.io/api/1/news?apikey={api_key}&q={query}&country={group}&language=es,en"
-
-                response = requests.get(url)
-                response.raise_for_status()
-                articles = response.json().get('results', [])
-
-                for article in articles:
-                    article_url = article.get('link')
-                    if article_url and article_url not in seen_urls:
-                        all_articles.append({
-                            "source_url": article_url,
-                            "content": f"{article.get('title', '')}. {article.get('description', '')}",
-                            "source_type": "noticia",
-                            "country": article.get('country', [])[0] if (isinstance(article.get('country'), list) and article.get('country')) else None
-                        })
-                        seen_urls.add(article_url)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=NEWS_FETCH_WORKERS) as executor:
+        session.mount("https://", adapter)
+        futures = [
+            (group, keyword, executor.submit(_fetch_newsdata, session, api_key, keyword, group, bucket))
+            for group, keyword in jobs
+        ]
 
+        # Consumimos en orden de envío para conservar la prioridad por Tiers
+        for group, keyword, future in futures:
+            try:
+                articles = future.result()
             except requests.exceptions.RequestException as e:
-                print(f"    -> Error en la consulta para '{keyword}': {e}")
-            finally:
-                print("    -> Pausa de 30 segundos...")
-                time.sleep(30)
+                print(f"    -> Error en la consulta para '{keyword}' ({group}): {e}")
+                continue
 
+            for article in articles:
+                article_url = article.get('link')
+                if not article_url:
+                    continue
+                article_url = canonicalize_url(article_url)
+                if article_url not in articles_by_url:
+                    articles_by_url[article_url] = Item(
+                        source_url=article_url,
+                        content=f"{article.get('title', '')}. {article.get('description', '')}",
+                        source_type="noticia",
+                        country=article.get('country', [])[0] if (isinstance(article.get('country'), list) and article.get('country')) else None
+                    )
+
+    all_articles = list(articles_by_url.values())
     print(f" -> Búsqueda de noticias finalizada. Se encontraron {len(all_articles)} artículos.", flush=True)
     return all_articles
 
 # --- PROMPTS DE ANÁLISIS CON IA ---
 # --- FILTRO DE PRE-CLASIFICACIÓN (HÍBRIDO: ML) ---
-def load_ml_model(model_path='filter_model.pkl'):
+ML_MODEL_PATH = 'filter_model.joblib'
+LEGACY_ML_MODEL_PATH = 'filter_model.pkl'
+
+@lru_cache(maxsize=1)
+def load_ml_model(model_path=ML_MODEL_PATH):
+    """
+    Carga el modelo Naive Bayes guardado por train_model.py.
+    El formato joblib se abre con mmap_mode='r': los arrays del modelo se mapean
+    desde disco en lugar de copiarse a memoria. El .pkl antiguo se admite como fallback.
+    Memoizado: la carga al importar el módulo y las llamadas posteriores
+    (p. ej. process_opportunities) comparten el mismo objeto.
+    """
     try:
         if os.path.exists(model_path):
-            with open(model_path, 'rb') as f:
+            return joblib.load(model_path, mmap_mode='r')
+        if os.path.exists(LEGACY_ML_MODEL_PATH):
+            print(f"  -> AVISO: usando modelo legacy {LEGACY_ML_MODEL_PATH}. Re-ejecuta train_model.py para migrarlo.")
+            with open(LEGACY_ML_MODEL_PATH, 'rb') as f:
                 return pickle.load(f)
     except Exception as e:
         print(f"  -> Error loading ML model: {e}")
     return None
 
+def unpack_nb_model(model):
+    """
+    Extrae de la Pipeline entrenada (vect -> clf) lo necesario para puntuar sin
+    pasar por predict_proba: el vectorizador, la matriz log P(token|clase)
+    transpuesta, el log-prior y la columna de la clase relevante (1).
+    Devuelve None si el modelo no tiene la forma esperada.
+    """
+    try:
+        vectorizer = model.named_steps['vect']
+        clf = model.named_steps['clf']
+        relevant_col = list(clf.classes_).index(1)
+        feature_log_prob_t = np.ascontiguousarray(clf.feature_log_prob_.T)
+        return vectorizer, feature_log_prob_t, np.asarray(clf.class_log_prior_), relevant_col
+    except (AttributeError, KeyError, ValueError) as e:
+        print(f"  -> AVISO: modelo ML sin formato Naive Bayes esperado ({e}); se usará predict_proba.")
+        return None
+
+def nb_relevance_scores(contents, kernel):
+    """
+    Probabilidad de la clase relevante para cada texto: una sola multiplicación
+    dispersa (conteos x log-probs) más el log-prior, normalizada con softmax.
+    Equivale a MultinomialNB.predict_proba sin la validación por llamada.
+    """
+    vectorizer, feature_log_prob_t, class_log_prior, relevant_col = kernel
+    counts = vectorizer.transform(contents)
+    jll = np.asarray(counts @ feature_log_prob_t) + class_log_prior
+    jll -= jll.max(axis=1, keepdims=True)
+    probs = np.exp(jll)
+    return probs[:, relevant_col] / probs.sum(axis=1)
+
 # Cargar modelo al iniciar (variable global para no recargar)
 ml_model = load_ml_model()
+nb_kernel = unpack_nb_model(ml_model) if ml_model else None
 
-def pre_filter_content(content, config):
+def pre_filter_contents(contents, config):
     """
-    Filtro Híbrido:
-    1. Intenta primero el filtro semántico (Sentence Transformers)
-    2. Fallback: Naive Bayes si el semántico no está disponible
+    Versión por lotes del filtro híbrido: puntúa todos los textos de una vez
+    (un solo encode semántico o un solo predict_proba) y devuelve una lista de
+    booleanos alineada con `contents` (True = pasar a la IA).
     """
-    if not content:
-        return False
+    verdicts = [bool(content) for content in contents]
+    indexed = [(i, content) for i, content in enumerate(contents) if verdicts[i]]
+    if not indexed:
+        return verdicts
     
     # 1. SEMANTIC FILTERING (Primary - uses embeddings with reasons)
     stats = get_training_stats()
     if stats['model_loaded'] and (stats['positive_count'] > 0 or stats['negative_count'] > 0):
-        return semantic_pre_filter(content, threshold=ML_FILTER_THRESHOLD)
+        gated = [content if passed else "" for content, passed in zip(contents, verdicts)]
+        return semantic_pre_filter_batch(gated, threshold=ML_FILTER_THRESHOLD)
     
     # 2. NAIVE BAYES FALLBACK (If no semantic data yet)
     if ml_model:
         try:
-            # Predict probability: [prob_irrelevant, prob_relevant]
-            proba = ml_model.predict_proba([content])[0]
-            prob_relevant = proba[1]
-            
-            if prob_relevant < ML_FILTER_THRESHOLD: 
-                print(f"  -> ML Filter (Naive Bayes): REJECTED (Score: {prob_relevant:.2f})")
-                return False
+            # Predict probability for all texts at once: column 1 = prob_relevant
+            texts = [content for _, content in indexed]
+            if nb_kernel:
+                probs = nb_relevance_scores(texts, nb_kernel)
+            else:
+                probs = ml_model.predict_proba(texts)[:, 1]
+            for (i, _), prob_relevant in zip(indexed, probs):
+                if prob_relevant < ML_FILTER_THRESHOLD:
+                    print(f"  -> ML Filter (Naive Bayes): REJECTED (Score: {prob_relevant:.2f})")
+                    verdicts[i] = False
                 
         except Exception as e:
             print(f"  -> ML Prediction Error: {e}")
 
     # If no model or model approves, pass through
-    return True
+    return verdicts
+
+def pre_filter_content(content, config):
+    """
+    Filtro Híbrido:
+    1. Intenta primero el filtro semántico (Sentence Transformers)
+    2. Fallback: Naive Bayes si el semántico no está disponible
+    """
+    if not content:
+        return False
+    
+    # 1. SEMANTIC FILTERING (Primary - uses embeddings with reasons)
+    stats = get_training_stats()
+    if stats['model_loaded'] and (stats['positive_count'] > 0 or stats['negative_count'] > 0):
+        return semantic_pre_filter(content, threshold=ML_FILTER_THRESHOLD)
+    
+    return pre_filter_contents([content], config)[0]
 
 
 # --- PROMPT UNIFICADO DE ANÁLISIS ---
-def get_combined_analysis_prompt(text_to_analyze, source_type):
+@lru_cache(maxsize=1)
+def _get_learned_criteria():
     """
-    Combina clasificación y extracción en una sola llamada para ahorrar tokens.
+    Devuelve (learned_criteria, guidance_text) a partir de las reglas destiladas
+    o, si no existen, de los ejemplos de feedback más recientes.
+    Se calcula una vez por ciclo: run_collection_phase llama a
+    clear_prompt_cache() al empezar para recoger reglas nuevas.
     """
     # Load distilled rules that condense ALL feedback into compact criteria
     distilled_rules = load_distilled_rules()
@@ -182,9 +409,19 @@ def get_combined_analysis_prompt(text_to_analyze, source_type):
         if feedback_examples['relevant']:
             learned_criteria = "\n**EJEMPLOS RELEVANTES:**\n" + "\n".join([f"- {ex['headline']}" for ex in feedback_examples['relevant']])
 
+    return learned_criteria, guidance_text
+
+@lru_cache(maxsize=8)
+def _combined_prompt_prefix(scope="del siguiente texto"):
+    """
+    Parte fija del prompt unificado (contexto + criterios), compartida por el
+    prompt individual y el de lotes; `scope` indica qué textos se analizan.
+    """
+    learned_criteria, guidance_text = _get_learned_criteria()
+
     return f"""
         Tu rol es actuar como un analista de desarrollo de negocio para Igeneris. 
-        Realiza un análisis COMPLETO (Clasificación + Extracción) del siguiente texto.
+        Realiza un análisis COMPLETO (Clasificación + Extracción) {scope}.
         
         **CONTEXTO SOBRE IGENERIS:**
         {IGENERIS_CONTEXT}
@@ -196,7 +433,18 @@ def get_combined_analysis_prompt(text_to_analyze, source_type):
         {learned_criteria}
         {guidance_text}
 
-        **Texto a analizar ({source_type}):**
+        """
+
+def clear_prompt_cache():
+    """Invalida los prompts cacheados (reglas destiladas o feedback nuevos)."""
+    _get_learned_criteria.cache_clear()
+    _combined_prompt_prefix.cache_clear()
+
+def get_combined_analysis_prompt(text_to_analyze, source_type):
+    """
+    Combina clasificación y extracción en una sola llamada para ahorrar tokens.
+    """
+    return _combined_prompt_prefix() + f"""**Texto a analizar ({source_type}):**
         "{text_to_analyze}"
 
         **INSTRUCCIONES DE RESPUESTA:**
@@ -219,6 +467,60 @@ def get_combined_analysis_prompt(text_to_analyze, source_type):
         }}
     """
 
+def get_batch_analysis_prompt(items):
+    """
+    Variante por lotes de get_combined_analysis_prompt: analiza N textos en una
+    sola llamada y pide un array JSON con un objeto por texto (mismo esquema).
+    El contexto de Igeneris y los criterios aprendidos se envían una sola vez.
+    """
+    texts_block = "\n\n".join(
+        f'[{i}] ({item.source_type}):\n"{item.content}"' for i, item in enumerate(items)
+    )
+
+    prefix = _combined_prompt_prefix(f"de CADA UNO de los {len(items)} textos siguientes, de forma independiente")
+    return prefix + f"""**Textos a analizar:**
+        {texts_block}
+
+        **INSTRUCCIONES DE RESPUESTA:**
+        Responde ÚNICAMENTE con un array JSON de {len(items)} objetos, uno por texto y en el mismo orden.
+        Cada objeto debe incluir "index" con el número del texto analizado.
+        
+        Si NO es una oportunidad (is_opportunity = false), el objeto debe ser:
+        {{
+            "index": 0,
+            "is_opportunity": false,
+            "reason": "Explicación breve de por qué se descartó"
+        }}
+
+        Si SÍ es una oportunidad (is_opportunity = true), el objeto debe incluir los detalles:
+        {{
+            "index": 0,
+            "is_opportunity": true,
+            "company_name": "Nombre de la empresa",
+            "opportunity_summary": "Resumen ejecutivo de la acción concreta",
+            "igeneris_fit": "Por qué encaja con Igeneris",
+            "proposed_solution": "Hipótesis de solución/servicio",
+            "value_proposition": "Propuesta de valor en una frase"
+        }}
+    """
+
+def split_batch_results(batch_result, batch_size):
+    """
+    Reparte la respuesta por lotes en una lista alineada con los items enviados.
+    Las posiciones sin resultado válido quedan a None (se reintentan como API error).
+    """
+    results = [None] * batch_size
+    if not isinstance(batch_result, list):
+        return results
+
+    for position, result in enumerate(batch_result):
+        if not isinstance(result, dict):
+            continue
+        index = result.pop("index", position)
+        if isinstance(index, int) and 0 <= index < batch_size and results[index] is None:
+            results[index] = result
+    return results
+
 def analyze_text_with_ai(prompt, model_name="gemini-2.0-flash"):
     """
     Analyzes text using the specified Gemini model.
@@ -235,7 +537,7 @@ def analyze_text_with_ai(prompt, model_name="gemini-2.0-flash"):
             model = genai.GenerativeModel(model_name)
             response = model.generate_content(prompt)
             json_text = response.text.strip().lstrip("```json").rstrip("```")
-            return json.loads(json_text)
+            return json_loads(json_text)
         except Exception as e:
             error_str = str(e)
             if "429" in error_str:
@@ -254,36 +556,37 @@ def analyze_text_with_ai(prompt, model_name="gemini-2.0-flash"):
 def run_collection_phase(config):
     """
     Flujo principal que ahora aplica la búsqueda por Tiers a TODAS las fuentes.
+    Acepta el dict de config.json o un CompiledConfig ya precalculado.
     """
     print("Iniciando fase de recolección de oportunidades...", flush=True)
+    config = compile_config(config)
+    clear_prompt_cache()  # Reglas destiladas/feedback pueden haber cambiado desde el último ciclo
+    # Cargar el modelo semántico en segundo plano mientras se descargan noticias y empleos
+    semantic_warmup = warm_up_async()
     all_items_to_process = []
 
-    data_sources = config.get("data_sources", {})
-    search_tiers = config.get("search_tiers", {}).values()
-
     # 1. Recolectar Noticias si está habilitado
-    if data_sources.get("news_api", {}).get("enabled", False):
+    if config.news_enabled:
         all_items_to_process.extend(get_news_from_newsdata(config))
 
     # 2. Recolectar Empleos si está habilitado
-    if data_sources.get("job_portals", {}).get("enabled", False):
+    if config.jobs_enabled:
         print(" -> Buscando vacantes de empleo (estrategia jerárquica por Tiers)...", flush=True)
-        job_titles = config.get("job_monitoring", {}).get("target_job_titles", [])
 
         # --- CAMBIO: El bucle de empleos ahora también usa los Tiers ---
-        for tier_countries_str in search_tiers:
+        for tier_countries in config.tier_countries:
             # La API de Glassdoor (a través de nuestra URL) solo acepta un país a la vez
-            for location in tier_countries_str.split(','):
+            for location in tier_countries:
                 print(f"\n--- Buscando empleos en el país: {location} ---", flush=True)
-                for title in job_titles:
+                for title in config.job_titles:
                     found_jobs = scrape_glassdoor_jobs(title, location)
                     for job in found_jobs:
-                        all_items_to_process.append({
-                            "source_url": job["source_url"],
-                            "content": f"Vacante: {job['title']}. Empresa: {job['company_name']}. Ubicación: {job['location']}",
-                            "source_type": "vacante",
-                            "country": location
-                        })
+                        all_items_to_process.append(Item(
+                            source_url=job["source_url"],
+                            content=f"Vacante: {job['title']}. Empresa: {job['company_name']}. Ubicación: {job['location']}",
+                            source_type="vacante",
+                            country=location
+                        ))
 
     if not all_items_to_process:
         print("Fase de recolección finalizada. No se encontraron nuevos items para analizar.", flush=True)
@@ -292,92 +595,36 @@ def run_collection_phase(config):
     # BATCH FILTER: Score all articles and guarantee min 5 pass
     MIN_GUARANTEED_PASS = 10
     print(f"\n📊 Aplicando filtro semántico por lotes (mínimo {MIN_GUARANTEED_PASS} garantizados)...", flush=True)
+    semantic_warmup.join()
     batch_results = batch_filter_articles(all_items_to_process, threshold=ML_FILTER_THRESHOLD, min_pass=MIN_GUARANTEED_PASS)
     
     # Create a map of URL -> (passed, explanation) for quick lookup
     batch_filter_map = {}
     passed_count = 0
     for article, score, passed, explanation in batch_results:
-        batch_filter_map[article['source_url']] = (passed, explanation, score)
+        batch_filter_map[article.source_url] = (passed, explanation, score)
         if passed:
             passed_count += 1
     print(f"  -> {passed_count} artículos pasan el filtro (de {len(all_items_to_process)} totales)", flush=True)
 
-    processed_urls = get_all_opportunity_urls()
-    recent_opportunities = get_recent_opportunities(days_back=7)  # Últimos 7 días para deduplicación
+    # Snapshot inmutable: membresía O(1) y sin riesgo de mutarlo durante el bucle
+    # Canonicalizadas igual que las entrantes: filas antiguas con utm_*, fragmento o host en mayúsculas
+    processed_urls = frozenset(map(canonicalize_url, get_all_opportunity_urls()))
+    cycle_urls = set()  # URLs ya vistas en este ciclo (p.ej. vacantes repetidas entre títulos)
+    # Últimos 7 días para deduplicación, indexados por token/entidad para comparar solo candidatos
+    recent_index = RecentOpportunityIndex(get_recent_opportunities(days_back=7), url_key=canonicalize_url)
+    # Resultados de dedup del ciclo por (texto, tamaño del índice): el mismo texto con otra URL
+    # (sindicación, reintentos de pendientes) no repite la comparación mientras el índice no cambie
+    dedup_cache = {}
     new_opportunities_count = 0
     duplicates_found = 0
     api_call_counter = 0  # Tracks total API calls across all models
+    pending_batch = []  # Items que han superado los filtros y esperan análisis IA
+    db_writes = PendingWrites()  # Inserciones del ciclo: un commit por lote analizado, no por item
 
-
-    for item in all_items_to_process:
-        # LAYER 1: URL-based deduplication (fast)
-        if item["source_url"] in processed_urls:
-            continue
-
-        print(f"\nProcesando: {item['source_url']}", flush=True)
-
-        # LAYER 2: Batch Semantic Filter (pre-computed with top-5 guarantee)
-        item_url = item['source_url']
-        if item_url in batch_filter_map:
-            passed, explanation, score = batch_filter_map[item_url]
-            if not passed:
-                print(f"  -> FILTRO SEMÁNTICO: RECHAZADO ({explanation})", flush=True)
-                continue
-            elif 'GARANTIZADO' in explanation:
-                print(f"  -> {explanation}", flush=True)
-
-        # LAYER 3: Early Semantic Deduplication (Before AI) - ZERO COST
-        # Intentamos detectar duplicados usando el texto crudo. 
-        # Pasamos empresa="" porque aun no la conocemos, pero la similitud de texto 
-        # y la extraccion de entidades dentro de deduplicator haran el trabajo.
-        is_duplicate, duplicate_info = is_duplicate_opportunity(
-            new_headline=item["content"], # Usamos el contenido/titulo raw
-            new_company="", # No la tenemos aun
-            recent_opportunities=recent_opportunities,
-            days_lookback=7
-        )
-
-        if is_duplicate:
-            print(f"  -> DUPLICADO SEMÁNTICO DETECTADO (Pre-AI).", flush=True)
-            print(f"     Similar a: {duplicate_info['headline']}", flush=True)
-            print(f"     Ahorro de token.", flush=True)
-            duplicates_found += 1
-            continue
-        
-        
-        # LAYER 4: Model Rotation & API Call Budget
-        # Determine which model to use based on call count
-        current_model = None
-        calls_made = 0
-        
-        for model_config in MODEL_ROTATION:
-            if api_call_counter < calls_made + model_config["limit"]:
-                current_model = model_config["name"]
-                calls_remaining_this_model = calls_made + model_config["limit"] - api_call_counter
-                break
-            calls_made += model_config["limit"]
-        
-        # If no model available (exceeded all limits), stop
-        if current_model is None:
-            print(f"\n⚠️ LÍMITE TOTAL ALCANZADO: {TOTAL_DAILY_LIMIT} llamadas.", flush=True)
-            print(f"   Todos los modelos agotados. Deteniendo procesamiento.", flush=True)
-            print(f"   Items procesados: {api_call_counter}, Restantes: {len(all_items_to_process) - all_items_to_process.index(item)}", flush=True)
-            break
-        
-        # Log which model we're using
-        if api_call_counter == 0 or api_call_counter % 20 == 0:
-            print(f"\n📊 Usando modelo: {current_model} (Llamada {api_call_counter + 1}/{TOTAL_DAILY_LIMIT})", flush=True)
-
-        # Rate limiting: Sleep before making the call
-        time.sleep(RATE_LIMIT_SLEEP)
-
-        # Make the API call with the selected model
-        analysis_prompt = get_combined_analysis_prompt(item["content"], item["source_type"])
-        analysis_result = analyze_text_with_ai(analysis_prompt, model_name=current_model)
-        api_call_counter += 1  # Increment counter after API call
-
-
+    def handle_analysis_result(item, analysis_result):
+        """Persiste, notifica y entrena el filtro semántico según el resultado de la IA."""
+        nonlocal new_opportunities_count
 
         if analysis_result and analysis_result.get("is_opportunity") is True:
             print("  -> OPORTUNIDAD DETECTADA Y ANALIZADA.", flush=True)
@@ -390,63 +637,173 @@ def run_collection_phase(config):
             # (Aunque podriamos repetirla aqui para mayor precision con el nombre exacto de la empresa,
             #  pero para ahorrar tokens confiamos en el filtro previo y la "novedad" real).
 
-            add_opportunity(
-                url=item["source_url"],
+            analysis_json_str = json_dumps(analysis_result)  # Serializado una vez para DB y Slack
+            db_writes.add_opportunity(
+                url=item.source_url,
                 headline=new_headline,
-                source_type=item["source_type"],
-                country=item.get("country"),
-                content=item.get("content"),
-                analysis_json=json.dumps(analysis_result)
+                source_type=item.source_type,
+                country=item.country,
+                content=item.content,
+                analysis_json=analysis_json_str
             )
+            # Escribir antes de notificar: los botones de feedback de Slack buscan la fila por URL
+            db_writes.flush()
 
             send_slack_notification(
-                analysis_json_str=json.dumps(analysis_result),
-                source_url=item["source_url"],
-                country=item.get("country")
+                analysis_json_str=analysis_json_str,
+                source_url=item.source_url,
+                country=item.country,
+                analysis=analysis_result  # Ya parseado: Slack no vuelve a hacer json.loads
             )
             new_opportunities_count += 1
 
             # Train semantic filter with this positive example
-            text_for_training = item.get("content") or item.get("headline") or ""
+            text_for_training = item.content or item.headline or ""
             if text_for_training:
                 add_positive_example(text_for_training)
 
-            # Agregar a recent_opportunities para detectar duplicados en este mismo ciclo
-            recent_opportunities.append({
+            # Agregar al índice de recientes para detectar duplicados en este mismo ciclo
+            recent_index.add({
                 'headline': new_headline,
                 'company_name': new_company,
-                'source_url': item["source_url"],
-                'notified_at': datetime.now().isoformat(),
-                'created_at': datetime.now().isoformat()
+                'source_url': item.source_url,
+                'notified_at': datetime.now(),
+                'created_at': datetime.now()
             })
         elif analysis_result is None:
             # API ERROR - Queue article for retry in next cycle
             print(f"  -> ERROR API: Guardando para reintentar.", flush=True)
-            api_call_counter -= 1  # Refund the call since it failed
-            add_pending_article(
-                url=item["source_url"],
-                headline=item.get("headline", ""),
-                source_type=item["source_type"],
-                country=item.get("country"),
-                content=item.get("content")
+            db_writes.add_pending_article(
+                url=item.source_url,
+                headline=item.headline,
+                source_type=item.source_type,
+                country=item.country,
+                content=item.content
             )
         else:
             # AI rejected - SAVE for ML training with semantic embeddings
             reason = analysis_result.get("reason", "No especificada")
             print(f"  -> IRRELEVANTE (AI). Razón: {reason}", flush=True)
-            add_ai_rejected_article(
-                url=item["source_url"],
-                headline=item.get("headline", ""),
-                source_type=item["source_type"],
-                country=item.get("country"),
-                content=item.get("content"),
+            db_writes.add_ai_rejected_article(
+                url=item.source_url,
+                headline=item.headline,
+                source_type=item.source_type,
+                country=item.country,
+                content=item.content,
                 rejection_reason=reason
             )
             # Train semantic filter with this rejection
-            text_for_training = item.get("content") or item.get("headline") or ""
+            text_for_training = item.content or item.headline or ""
             if text_for_training:
                 add_negative_example(text_for_training, reason)
 
+    def analyze_pending_batch():
+        """
+        Envía el lote acumulado a Gemini en UNA sola llamada (una pausa por lote).
+        Devuelve False si se agotó el presupuesto de llamadas.
+        """
+        nonlocal api_call_counter
+        batch = pending_batch[:]
+        pending_batch.clear()
+
+        # LAYER 4: Model Rotation & API Call Budget
+        # If no model available (exceeded all limits), stop
+        if api_call_counter >= TOTAL_DAILY_LIMIT:
+            print(f"\n⚠️ LÍMITE TOTAL ALCANZADO: {TOTAL_DAILY_LIMIT} llamadas.", flush=True)
+            print(f"   Todos los modelos agotados. Deteniendo procesamiento.", flush=True)
+            print(f"   Llamadas realizadas: {api_call_counter}, Items sin analizar en el lote: {len(batch)}", flush=True)
+            return False
+        current_model = MODEL_SCHEDULE[api_call_counter]
+        
+        # Log which model we're using
+        if api_call_counter == 0 or api_call_counter % 20 == 0:
+            print(f"\n📊 Usando modelo: {current_model} (Llamada {api_call_counter + 1}/{TOTAL_DAILY_LIMIT})", flush=True)
+
+        # Rate limiting: wait only until the model's next free slot
+        MODEL_RATE_LIMITERS[current_model].acquire()
+
+        # Make the API call with the selected model
+        print(f"\n🤖 Analizando lote de {len(batch)} items con IA...", flush=True)
+        if len(batch) == 1:
+            analysis_prompt = get_combined_analysis_prompt(batch[0].content, batch[0].source_type)
+            results = [analyze_text_with_ai(analysis_prompt, model_name=current_model)]
+        else:
+            analysis_prompt = get_batch_analysis_prompt(batch)
+            results = split_batch_results(analyze_text_with_ai(analysis_prompt, model_name=current_model), len(batch))
+        api_call_counter += 1  # Increment counter after API call
+
+        if all(result is None for result in results):
+            api_call_counter -= 1  # Refund the call since it failed
+
+        for item, analysis_result in zip(batch, results):
+            print(f"\nResultado: {item.source_url}", flush=True)
+            handle_analysis_result(item, analysis_result)
+        db_writes.flush()
+        return True
+
+    for position, item in enumerate(all_items_to_process):
+        # LAYER 1: URL-based deduplication (fast)
+        # (todas las comparaciones usan la URL canónica: cubre filas antiguas guardadas con utm_*/fragmentos)
+        url_key = canonicalize_url(item.source_url)
+        if url_key in processed_urls or url_key in cycle_urls or item.source_url in recent_index:
+            continue
+        cycle_urls.add(url_key)
+
+        print(f"\nProcesando: {item.source_url}", flush=True)
+
+        # LAYER 2: Batch Semantic Filter (pre-computed with top-5 guarantee)
+        item_url = item.source_url
+        if item_url in batch_filter_map:
+            passed, explanation, score = batch_filter_map[item_url]
+            if not passed:
+                print(f"  -> FILTRO SEMÁNTICO: RECHAZADO ({explanation})", flush=True)
+                if score < SEMANTIC_HARD_REJECT and item.content:
+                    # Claramente irrelevante: registrar la URL para que los próximos ciclos la descarten en LAYER 1
+                    db_writes.add_semantic_rejected_article(
+                        url=item.source_url,
+                        headline=item.headline,
+                        source_type=item.source_type,
+                        country=item.country,
+                        content=item.content,
+                        score=score
+                    )
+                continue
+            elif 'GARANTIZADO' in explanation:
+                print(f"  -> {explanation}", flush=True)
+
+        # LAYER 3: Early Semantic Deduplication (Before AI) - ZERO COST
+        # Intentamos detectar duplicados usando el texto crudo. 
+        # Pasamos empresa="" porque aun no la conocemos, pero la similitud de texto 
+        # y la extraccion de entidades dentro de deduplicator haran el trabajo.
+        dedup_key = (item.content, len(recent_index))
+        if dedup_key not in dedup_cache:
+            dedup_cache[dedup_key] = is_duplicate_opportunity(
+                new_headline=item.content, # Usamos el contenido/titulo raw
+                new_company="", # No la tenemos aun
+                recent_opportunities=recent_index.candidates(item.content),
+                days_lookback=None  # get_recent_opportunities ya filtró los últimos 7 días en SQL
+            )
+        is_duplicate, duplicate_info = dedup_cache[dedup_key]
+
+        if is_duplicate:
+            print(f"  -> DUPLICADO SEMÁNTICO DETECTADO (Pre-AI).", flush=True)
+            print(f"     Similar a: {duplicate_info['headline']}", flush=True)
+            print(f"     Ahorro de token.", flush=True)
+            duplicates_found += 1
+            continue
+
+        # LAYER 4: Acumular en lote y analizar cuando esté completo
+        pending_batch.append(item)
+        if len(pending_batch) >= ANALYSIS_BATCH_SIZE and not analyze_pending_batch():
+            print(f"   Items restantes sin procesar: {len(all_items_to_process) - position - 1}", flush=True)
+            break
+    else:
+        # Analizar el último lote incompleto
+        if pending_batch:
+            analyze_pending_batch()
+
+    db_writes.flush()  # Descartes semánticos acumulados tras el último lote
+
     print(f"\nFase de recolección finalizada.", flush=True)
     print(f"  -> Nuevas oportunidades: {new_opportunities_count}", flush=True)
     print(f"  -> Duplicados semánticos evitados: {duplicates_found}", flush=True)
@@ -458,8 +815,8 @@ def run_collection_phase(config):
 
 if __name__ == '__main__':
     try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        with open('config.json', 'rb') as f:
+            config = compile_config(json_loads(f.read()))
         run_collection_phase(config)
     except FileNotFoundError:
         print("ERROR: No se encontró el archivo 'config.json'.")
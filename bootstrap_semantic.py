@@ -7,7 +7,7 @@ import sqlite3
 import os
 
 # Import semantic filter functions
-from semantic_filter import add_positive_example, add_negative_example, get_training_stats, get_model
+from semantic_filter import add_examples_batch, get_training_stats, get_model
 
 DB_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opportunities.db')
 
@@ -54,19 +54,17 @@ def bootstrap_semantic_filter():
         print("Run the agent first to collect some data, or this is a fresh install.")
         return
     
-    # Add positive examples
+    # Add positive examples (one batched encode)
     print(f"\nTraining positive examples...")
-    for i, (content, headline) in enumerate(positive_rows):
-        text = f"{headline or ''} {content or ''}"
-        if text.strip():
-            add_positive_example(text)
-            if (i + 1) % 10 == 0:
-                print(f"  Processed {i + 1}/{len(positive_rows)} positive examples")
+    positive_texts = [f"{headline or ''} {content or ''}" for content, headline in positive_rows]
+    added = add_examples_batch([text for text in positive_texts if text.strip()], 'positive')
+    print(f"  Processed {added}/{len(positive_rows)} positive examples")
     
-    # Add negative examples
+    # Add negative examples (one batched encode)
     print(f"\nTraining negative examples...")
     import json
-    for i, (content, headline, analysis_json) in enumerate(negative_rows):
+    negative_texts, negative_reasons = [], []
+    for content, headline, analysis_json in negative_rows:
         text = f"{headline or ''} {content or ''}"
         
         # Try to extract rejection reason from analysis_json
@@ -79,9 +77,11 @@ def bootstrap_semantic_filter():
                 pass
         
         if text.strip():
-            add_negative_example(text, reason)
-            if (i + 1) % 10 == 0:
-                print(f"  Processed {i + 1}/{len(negative_rows)} negative examples")
+            negative_texts.append(text)
+            negative_reasons.append(reason)
+    
+    added = add_examples_batch(negative_texts, 'negative', reasons=negative_reasons)
+    print(f"  Processed {added}/{len(negative_rows)} negative examples")
     
     # Show final stats
     stats = get_training_stats()
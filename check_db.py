@@ -12,13 +12,12 @@ def check_db():
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         
-        # Check total rows
-        cursor.execute("SELECT count(*) FROM opportunities")
-        total = cursor.fetchone()[0]
-        
-        # Check labeled rows
-        cursor.execute("SELECT count(*) FROM opportunities WHERE status IN ('relevant', 'irrelevant')")
-        labeled = cursor.fetchone()[0]
+        # Total and labeled rows in one pass
+        cursor.execute("""
+            SELECT count(*), count(*) FILTER (WHERE status IN ('relevant', 'irrelevant'))
+            FROM opportunities
+        """)
+        total, labeled = cursor.fetchone()
         
         print(f"Total Rows: {total}")
         print(f"Labeled Rows (Training Data): {labeled}")
@@ -10,14 +10,18 @@ else:
     cursor = conn.cursor()
     
     print("--- Database Statistics ---")
-    cursor.execute("SELECT status, COUNT(*) FROM opportunities GROUP BY status")
-    for row in cursor.fetchall():
-        print(f"Status '{row[0]}': {row[1]}")
+    # Single aggregate pass: per-status totals plus empty-content counts
+    cursor.execute("""
+        SELECT status, COUNT(*), COUNT(*) FILTER (WHERE content IS NULL OR content='')
+        FROM opportunities GROUP BY status
+    """)
+    rows = cursor.fetchall()
+    for status, total, _ in rows:
+        print(f"Status '{status}': {total}")
         
     print("\n--- Check Content ---")
     # Check if content is empty for notified items
-    cursor.execute("SELECT COUNT(*) FROM opportunities WHERE status='notified' AND (content IS NULL OR content='')")
-    empty_content = cursor.fetchone()[0]
+    empty_content = sum(empty for status, _, empty in rows if status == 'notified')
     print(f"Notified items with EMPTY content: {empty_content}")
 
     conn.close()
@@ -1,4 +1,6 @@
+import json
 import sqlite3
+import threading
 from datetime import datetime
 
 import os
@@ -6,27 +8,132 @@ import os
 # Usar ruta absoluta basada en la ubicación del archivo actual
 DB_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opportunities.db')
 
-def initialize_db():
-    """Crea la tabla de oportunidades si no existe."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # Asegurarnos de que la columna feedback_rationale existe
+BUSY_TIMEOUT_MS = 5000  # Espera ante un lock en lugar de fallar con "database is locked"
+_local = threading.local()  # Una conexión reutilizable por hilo (agente, hilos de Flask)
+_url_cache = None  # (DB_NAME, set de URLs): se carga una vez y se mantiene al insertar/borrar
+_url_cache_lock = threading.Lock()
+
+# Campos que debe tener un análisis para poder notificarse (formato rico de Slack)
+REQUIRED_ANALYSIS_FIELDS = ('company_name', 'opportunity_summary', 'igeneris_fit', 'proposed_solution', 'value_proposition')
+
+def is_complete_analysis(analysis_json):
+    """True si el JSON del análisis se puede parsear y tiene todos los REQUIRED_ANALYSIS_FIELDS no vacíos."""
+    if not analysis_json:
+        return False
     try:
-        cursor.execute("ALTER TABLE opportunities ADD COLUMN feedback_rationale TEXT;")
-    except sqlite3.OperationalError:
-        pass
-        
-    # Asegurarnos de que la columna country existe
+        analysis = json.loads(analysis_json)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(analysis, dict) and all(analysis.get(f) for f in REQUIRED_ANALYSIS_FIELDS)
+
+def _schema_ok(analysis_json):
+    """Valor de la columna schema_ok: 1 si el análisis está completo (se valida una vez al guardar)."""
+    return 1 if is_complete_analysis(analysis_json) else 0
+
+def _convert_timestamp(value):
+    """
+    Conversor de columnas TIMESTAMP (PARSE_DECLTYPES): devuelve datetime.
+    Tolerante: si el valor no es una fecha ISO (filas antiguas o escritas a mano),
+    se devuelve el texto tal cual en lugar de fallar la consulta.
+    """
+    text = value.decode('utf-8')
     try:
-        cursor.execute("ALTER TABLE opportunities ADD COLUMN country TEXT;")
-    except sqlite3.OperationalError:
-        pass
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return text
 
-    # Asegurarnos de que la columna content existe
+# Mismo formato que el adaptador por defecto ('YYYY-MM-DD HH:MM:SS.ffffff'), explícito y con su conversor
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+
+def _connect():
+    """
+    Devuelve la conexión del hilo actual, creándola y configurando los
+    PRAGMAs la primera vez (o si DB_NAME ha cambiado). Las funciones de este
+    módulo la reutilizan en lugar de abrir y cerrar una conexión por llamada.
+    WAL permite que los lectores (agente, web_app) no se bloqueen con las
+    escrituras, y synchronous=NORMAL reduce los fsync por commit.
+    """
+    cached = getattr(_local, 'conn', None)
+    if cached is not None and cached[0] == DB_NAME:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    # PARSE_DECLTYPES: las columnas TIMESTAMP llegan ya como datetime
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute("PRAGMA journal_mode=WAL")  # Persistente en el fichero
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20 MB de caché de páginas
     try:
-        cursor.execute("ALTER TABLE opportunities ADD COLUMN content TEXT;")
+        _add_missing_columns(conn)
+        _create_indexes(conn)  # El agente no llama a initialize_db(): asegurar índices aquí también
     except sqlite3.OperationalError:
-        pass
+        pass  # Tabla aún no creada (initialize_db la creará junto con los índices)
+    _local.conn = (DB_NAME, conn)
+    return conn
+
+def _create_indexes(conn):
+    """
+    Índices para los filtros/órdenes habituales (IF NOT EXISTS: idempotente).
+    source_url ya tiene el índice implícito de su UNIQUE.
+    """
+    # status (+ notified_at): conteos por estado, pendientes, y
+    # get_recent_opportunities (WHERE status ORDER BY notified_at DESC LIMIT) como recorrido de índice acotado
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_opp_status_notified ON opportunities(status, notified_at DESC)")
+    # Parcial: solo filas con justificación, para get_all_feedback_examples
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_opp_feedback ON opportunities(status, notified_at DESC)
+        WHERE feedback_rationale IS NOT NULL
+    """)
+    conn.commit()
+
+# Columnas añadidas después de la primera versión del esquema
+_MIGRATED_COLUMNS = [('feedback_rationale', 'TEXT'), ('country', 'TEXT'), ('content', 'TEXT'), ('schema_ok', 'INTEGER')]
+
+def _add_missing_columns(conn):
+    """
+    Añade a bases de datos antiguas las columnas de _MIGRATED_COLUMNS que les falten.
+    Una lectura de PRAGMA table_info; solo hay ALTER TABLE si falta alguna columna.
+    """
+    have = {row[1] for row in conn.execute("PRAGMA table_info(opportunities)")}
+    if not have:
+        return  # La tabla aún no existe
+    for column, ddl in _MIGRATED_COLUMNS:
+        if column not in have:
+            conn.execute(f"ALTER TABLE opportunities ADD COLUMN {column} {ddl}")
+    conn.commit()
+
+def get_connection():
+    """Conexión compartida del hilo actual (para scripts de inspección); no cerrarla."""
+    return _connect()
+
+def _release(conn):
+    """
+    Sustituye a conn.close() con la conexión compartida: la deja abierta pero
+    deshace cualquier transacción que un error haya dejado a medias, para no
+    retener el lock de escritura entre llamadas.
+    """
+    if conn.in_transaction:
+        conn.rollback()
+
+def initialize_db(db=None):
+    """
+    Crea la tabla de oportunidades si no existe.
+
+    Args:
+        db (str, optional): Ruta de la base de datos a usar desde ahora en este
+            módulo (p.ej. ':memory:' para pruebas e inspección sin tocar disco).
+            Por defecto se mantiene DB_NAME.
+    """
+    global DB_NAME
+    if db is not None:
+        DB_NAME = db
+    conn = _connect()
+    cursor = conn.cursor()
+    # Asegurarnos de que existen las columnas añadidas en versiones posteriores
+    _add_missing_columns(conn)
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS opportunities (
@@ -44,24 +151,28 @@ def initialize_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             processed_at TIMESTAMP,
             notified_at TIMESTAMP,
-            feedback_rationale TEXT
+            feedback_rationale TEXT,
+            schema_ok INTEGER
         )
     ''')
     conn.commit()
-    conn.close()
+    _create_indexes(conn)
+    _release(conn)
     print("Base de datos inicializada correctamente.")
 
 def add_opportunity(url, headline, source_type, country=None, content=None, analysis_json=None):
     """Añade una nueva oportunidad con todos sus detalles."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     try:
         cursor.execute("""
             INSERT INTO opportunities 
-            (source_url, headline, source_type, country, content, analysis_json, processed_at) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (url, headline, source_type, country, content, analysis_json, datetime.now()))
+            (source_url, headline, source_type, country, content, analysis_json, processed_at, schema_ok) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (url, headline, source_type, country, content, analysis_json, datetime.now(),
+              _schema_ok(analysis_json)))
         conn.commit()
+        _remember_urls([url])
         # Devolvemos el ID de la fila insertada para que el agente sepa que tuvo éxito
         return cursor.lastrowid
     except sqlite3.IntegrityError:
@@ -72,95 +183,171 @@ def add_opportunity(url, headline, source_type, country=None, content=None, anal
         print(f"  -> ERROR al añadir oportunidad en la base de datos: {e}")
         return None
     finally:
-        conn.close()
+        _release(conn)
 
 def get_opportunities_by_status(status):
     """Obtiene todas las oportunidades con un estado específico, incluyendo el tipo de fuente."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     # CAMBIO: Añadimos 'source_type' a la consulta SELECT
     cursor.execute("SELECT id, source_url, headline, source_type FROM opportunities WHERE status = ?", (status,))
     rows = cursor.fetchall()
-    conn.close()
+    _release(conn)
     # CAMBIO: Añadimos 'source_type' al diccionario que devolvemos
     return [{"id": row[0], "url": row[1], "headline": row[2], "source_type": row[3]} for row in rows]
 
 def get_analysis_json_by_id(opp_id):
     """Obtiene el JSON de análisis para una oportunidad específica."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("SELECT analysis_json FROM opportunities WHERE id = ?", (opp_id,))
     row = cursor.fetchone()
-    conn.close()
+    _release(conn)
     return row[0] if row else None
 
+# Columnas que transition() puede fijar junto con el estado
+_TRANSITION_COLUMNS = frozenset({
+    'trigger_event', 'score', 'analysis_json', 'processed_at', 'notified_at', 'feedback_rationale', 'company_name',
+    'schema_ok'
+})
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def transition(opp_id, new_status, **fields):
+    """
+    Cambia el estado de una oportunidad y fija a la vez otras columnas
+    (p.ej. analysis_json, notified_at) en un único UPDATE y commit, en lugar de
+    encadenar save_analysis + mark_as_notified.
+    Devuelve el id si la fila existía, None si no.
+    """
+    unknown = set(fields) - _TRANSITION_COLUMNS
+    if unknown:
+        raise ValueError(f"Columnas no permitidas en transition(): {sorted(unknown)}")
+    assignments = ', '.join(['status = ?'] + [f'{column} = ?' for column in fields])
+    params = [new_status, *fields.values(), opp_id]
+    conn = _connect()
+    try:
+        with conn:
+            if _HAS_RETURNING:
+                row = conn.execute(f"UPDATE opportunities SET {assignments} WHERE id = ? RETURNING id", params).fetchone()
+                return row[0] if row else None
+            cursor = conn.execute(f"UPDATE opportunities SET {assignments} WHERE id = ?", params)
+            return opp_id if cursor.rowcount else None
+    finally:
+        _release(conn)
+
 def update_opportunity_status(opp_id, new_status):
     """Actualiza el estado de una oportunidad."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE opportunities SET status = ?, processed_at = ? WHERE id = ?",
-                       (new_status, datetime.now(), opp_id))
-    conn.commit()
-    conn.close()
+    transition(opp_id, new_status, processed_at=datetime.now())
 
 def get_all_opportunity_urls():
     """
     Recupera un conjunto (set) de todas las URLs de las oportunidades
     que ya están en la base de datos para una verificación rápida de duplicados.
+    La primera llamada lee la tabla; las siguientes usan la caché del módulo,
+    que las inserciones/borrados de este módulo mantienen al día.
     """
+    global _url_cache
+    with _url_cache_lock:
+        if _url_cache is not None and _url_cache[0] == DB_NAME:
+            return set(_url_cache[1])
     try:
         # --- LA CORRECCIÓN ESTÁ AQUÍ ---
-        conn = sqlite3.connect(DB_NAME)
+        conn = _connect()
         # -------------------------------
 
-        cursor = conn.cursor()
-        cursor.execute("SELECT source_url FROM opportunities")
-        urls = {item[0] for item in cursor.fetchall()}
-        conn.close()
-        return urls
+        # Iterar el cursor en lugar de fetchall(): no se materializa la lista intermedia de tuplas
+        urls = {item[0] for item in conn.execute("SELECT source_url FROM opportunities")}
+        _release(conn)
+        with _url_cache_lock:
+            _url_cache = (DB_NAME, urls)
+        return set(urls)
     except sqlite3.Error as e:
         print(f"Error de base de datos al obtener URLs: {e}")
         return set() # Devuelve un conjunto vacío en caso de error
 
+def _remember_urls(urls):
+    """Añade URLs recién insertadas a la caché de get_all_opportunity_urls (si está cargada)."""
+    with _url_cache_lock:
+        if _url_cache is not None and _url_cache[0] == DB_NAME:
+            _url_cache[1].update(urls)
+
+def _invalidate_url_cache():
+    global _url_cache
+    with _url_cache_lock:
+        _url_cache = None
+
 def save_analysis(opp_id, trigger_event, score, analysis_json):
     """Guarda el resultado del análisis de la IA en la base de datos."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE opportunities
-        SET trigger_event = ?, score = ?, analysis_json = ?, status = 'analyzed', processed_at = ?
-        WHERE id = ?
-    """, (trigger_event, score, analysis_json, datetime.now(), opp_id))
-    conn.commit()
-    conn.close()
+    transition(opp_id, 'analyzed', trigger_event=trigger_event, score=score,
+               analysis_json=analysis_json, processed_at=datetime.now(), schema_ok=_schema_ok(analysis_json))
 
 def log_feedback_with_rationale(url, feedback, rationale):
     """
     NUEVA FUNCIÓN: Registra el feedback del usuario y su justificación.
     La antigua función log_feedback ha sido eliminada.
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("UPDATE opportunities SET status = ?, feedback_rationale = ? WHERE source_url = ?",
                    (feedback, rationale, url))
     conn.commit()
-    conn.close()
+    _release(conn)
 
 def mark_as_notified(opp_id):
     """Marca una oportunidad como notificada."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE opportunities SET status = 'notified', notified_at = ? WHERE id = ?",
-                       (datetime.now(), opp_id))
-    conn.commit()
-    conn.close()
+    transition(opp_id, 'notified', notified_at=datetime.now())
+
+_INSERT_OPPORTUNITY_SQL = """
+    INSERT OR IGNORE INTO opportunities 
+    (source_url, headline, source_type, country, content, analysis_json, processed_at, schema_ok) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def add_opportunities_bulk(rows):
+    """
+    Versión por lotes de add_opportunity: rows son tuplas
+    (url, headline, source_type, country, content, analysis_json).
+    Un solo executemany en una transacción; las URLs existentes se ignoran.
+    Devuelve el número de filas insertadas.
+    """
+    now = datetime.now()
+    rows = [tuple(row) + (now, _schema_ok(row[5])) for row in rows]
+    if not rows:
+        return 0
+    conn = _connect()
+    try:
+        with conn:
+            before = conn.total_changes
+            conn.executemany(_INSERT_OPPORTUNITY_SQL, rows)
+            inserted = conn.total_changes - before
+        _remember_urls(row[0] for row in rows)
+        return inserted
+    except Exception as e:
+        print(f"  -> ERROR al añadir oportunidades en la base de datos: {e}")
+        return 0
+    finally:
+        _release(conn)
+
+def update_status_bulk(opp_ids, new_status):
+    """Versión por lotes de update_opportunity_status: un executemany y un commit."""
+    now = datetime.now()
+    rows = [(new_status, now, opp_id) for opp_id in opp_ids]
+    if not rows:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # Toma el lock de escritura al empezar, no a mitad del lote
+            conn.executemany("UPDATE opportunities SET status = ?, processed_at = ? WHERE id = ?", rows)
+    finally:
+        _release(conn)
 
 def add_pending_article(url, headline, source_type, country=None, content=None):
     """
     Queue an article that failed API analysis for retry later.
     Status 'pending' indicates it should be retried in the next cycle.
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     try:
         cursor.execute("""
@@ -169,20 +356,20 @@ def add_pending_article(url, headline, source_type, country=None, content=None):
             VALUES (?, ?, ?, ?, ?, 'pending')
         """, (url, headline, source_type, country, content))
         conn.commit()
+        _remember_urls([url])
         return cursor.lastrowid
     except sqlite3.IntegrityError:
         # URL already exists
         return None
     finally:
-        conn.close()
+        _release(conn)
 
 def add_ai_rejected_article(url, headline, source_type, country=None, content=None, rejection_reason=None):
     """
     Save articles rejected by AI with the rejection reason for ML training.
     Status 'ai_rejected' is used for semantic filter training.
     """
-    import json
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     try:
         analysis_json = json.dumps({"is_opportunity": False, "reason": rejection_reason}) if rejection_reason else None
@@ -193,16 +380,89 @@ def add_ai_rejected_article(url, headline, source_type, country=None, content=No
             VALUES (?, ?, ?, ?, ?, ?, 'ai_rejected', ?)
         """, (url, headline, source_type, country, content, analysis_json, datetime.now()))
         conn.commit()
+        _remember_urls([url])
         return cursor.lastrowid
     except sqlite3.IntegrityError:
         # URL already exists
         return None
     finally:
-        conn.close()
+        _release(conn)
+
+class PendingWrites:
+    """
+    Buffer de inserciones de un ciclo del agente (oportunidades, rechazos de la
+    IA y pendientes). flush() las escribe con executemany en una sola
+    transacción, en lugar de un commit por artículo.
+    Mismas columnas y estados que add_opportunity / add_ai_rejected_article /
+    add_pending_article; las URLs ya existentes se ignoran igual que allí.
+    """
+
+    def __init__(self):
+        self.opportunities = []
+        self.rejected = []
+        self.pending = []
+
+    def __len__(self):
+        return len(self.opportunities) + len(self.rejected) + len(self.pending)
+
+    def add_opportunity(self, url, headline, source_type, country=None, content=None, analysis_json=None):
+        self.opportunities.append((url, headline, source_type, country, content, analysis_json, datetime.now(),
+                                   _schema_ok(analysis_json)))
+
+    def add_ai_rejected_article(self, url, headline, source_type, country=None, content=None, rejection_reason=None,
+                                status='ai_rejected'):
+        analysis_json = json.dumps({"is_opportunity": False, "reason": rejection_reason}) if rejection_reason else None
+        self.rejected.append((url, headline, source_type, country, content, analysis_json, status, datetime.now()))
+
+    def add_semantic_rejected_article(self, url, headline, source_type, country=None, content=None, score=None):
+        """
+        Artículo descartado por el filtro semántico con score claramente bajo
+        (status 'semantic_rejected', sin pasar por la IA). Solo sirve para que los
+        siguientes ciclos lo salten por URL; no se usa como ejemplo de entrenamiento.
+        """
+        reason = f"Score semántico bajo ({score:.2f})" if score is not None else "Score semántico bajo"
+        self.add_ai_rejected_article(url, headline, source_type, country, content, reason, status='semantic_rejected')
+
+    def add_pending_article(self, url, headline, source_type, country=None, content=None):
+        self.pending.append((url, headline, source_type, country, content))
+
+    def flush(self):
+        """Escribe todo lo acumulado en una transacción. Devuelve el número de filas insertadas."""
+        if not len(self):
+            return 0
+        conn = _connect()
+        try:
+            with conn:  # Una sola transacción: commit al salir, rollback si falla
+                before = conn.total_changes
+                conn.executemany(_INSERT_OPPORTUNITY_SQL, self.opportunities)
+                conn.executemany("""
+                    INSERT OR IGNORE INTO opportunities 
+                    (source_url, headline, source_type, country, content, analysis_json, 
+                     status, processed_at) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, self.rejected)
+                conn.executemany("""
+                    INSERT OR IGNORE INTO opportunities 
+                    (source_url, headline, source_type, country, content, status) 
+                    VALUES (?, ?, ?, ?, ?, 'pending')
+                """, self.pending)
+                inserted = conn.total_changes - before
+            _remember_urls(row[0] for rows in (self.opportunities, self.rejected, self.pending) for row in rows)
+        except Exception as e:
+            # Se conservan los buffers para reintentar en el siguiente flush
+            print(f"  -> ERROR al guardar el lote en la base de datos: {e}")
+            return 0
+        finally:
+            _release(conn)
+
+        self.opportunities.clear()
+        self.rejected.clear()
+        self.pending.clear()
+        return inserted
 
 def get_pending_articles():
     """Get all pending articles that need to be retried."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, source_url, headline, source_type, country, content 
@@ -211,7 +471,7 @@ def get_pending_articles():
         ORDER BY created_at ASC
     """)
     rows = cursor.fetchall()
-    conn.close()
+    _release(conn)
     return [
         {'id': r[0], 'source_url': r[1], 'headline': r[2], 
          'source_type': r[3], 'country': r[4], 'content': r[5]}
@@ -223,12 +483,16 @@ def clear_pending_articles():
     Clear all pending articles at the end of a cycle.
     Pending queue is a within-cycle safety net, not cross-cycle.
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM opportunities WHERE status = 'pending'")
     deleted = cursor.rowcount
     conn.commit()
-    conn.close()
+    if deleted > 0:
+        _invalidate_url_cache()
+    # Fin de ciclo: dejar que SQLite actualice estadísticas de los índices si lo necesita
+    conn.execute("PRAGMA optimize")
+    _release(conn)
     if deleted > 0:
         print(f"  -> Cola de pendientes limpiada: {deleted} artículos descartados")
     return deleted
@@ -243,7 +507,7 @@ def get_all_feedback_examples(limit_per_category=10):
     Returns:
         dict: Diccionario con listas de ejemplos relevantes e irrelevantes
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
 
     # Obtenemos los ejemplos relevantes MÁS RECIENTES (ordenados por fecha)
@@ -266,7 +530,7 @@ def get_all_feedback_examples(limit_per_category=10):
     """, (limit_per_category,))
     irrelevant_examples = cursor.fetchall()
 
-    conn.close()
+    _release(conn)
 
     # Devolvemos los resultados en un formato fácil de usar
     return {
@@ -274,38 +538,42 @@ def get_all_feedback_examples(limit_per_category=10):
         "irrelevant": [{"headline": row[0], "rationale": row[1]} for row in irrelevant_examples]
     }
 
-def get_recent_opportunities(days_back=7):
+def get_recent_opportunities(days_back=7, limit=100):
     """
     Recupera oportunidades recientes para verificar duplicados semánticos.
+    El filtro de fecha se hace en SQL (recorrido acotado de idx_opp_status_notified),
+    así que el resultado ya está dentro de la ventana de days_back días.
 
     Args:
         days_back (int): Número de días hacia atrás para buscar (default: 7)
+        limit (int): Máximo de filas (las más recientes primero)
 
     Returns:
         list: Lista de diccionarios con información de oportunidades recientes
     """
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     cursor = conn.cursor()
 
     # Solo buscamos oportunidades notificadas (ya enviadas a Slack)
+    # notified_at se guarda como 'YYYY-MM-DD HH:MM:SS.ffffff' (hora local), comparable con datetime()
     cursor.execute("""
-        SELECT headline, company_name, source_url, notified_at, created_at
+        SELECT headline, company_name, source_url, notified_at
         FROM opportunities
         WHERE status = 'notified'
+          AND notified_at >= datetime('now', 'localtime', ?)
         ORDER BY notified_at DESC
-        LIMIT 100
-    """)
+        LIMIT ?
+    """, (f'-{int(days_back)} days', limit))
 
     rows = cursor.fetchall()
-    conn.close()
+    _release(conn)
 
     return [
         {
             'headline': row[0],
             'company_name': row[1],
             'source_url': row[2],
-            'notified_at': row[3],
-            'created_at': row[4]
+            'notified_at': row[3]
         }
         for row in rows
     ]
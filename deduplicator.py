@@ -16,8 +16,62 @@ Date: October 2025
 
 import re
 import hashlib
+from collections import defaultdict
 from datetime import datetime, timedelta
 from difflib import SequenceMatcher
+try:
+    from rapidfuzz import fuzz, process  # Opcional: ratio en C++, mucho más rápido que difflib
+except ImportError:
+    fuzz = process = None
+
+# Patrones y stop words compilados una sola vez (se usan en cada comparación del bucle de dedup)
+_URL_RE = re.compile(r'http[s]?://\S+')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_NUM_RE = re.compile(r'\b\d+\b')
+_WS_RE = re.compile(r'\s+')
+# Nombres de empresas (palabras capitalizadas consecutivas), ej: "Banco Santander", "Microsoft Corporation"
+_COMPANY_RE = re.compile(r'\b([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+){0,3})\b')
+# Palabras clave de acción (M&A, inversión, expansión, etc.)
+_ACTION_KEYWORDS = (
+    'adquisición', 'fusión', 'inversión', 'expansión', 'lanzamiento',
+    'acquisition', 'merger', 'investment', 'expansion', 'launch',
+    'venture', 'partnership', 'transformación', 'digital'
+)
+# Una sola pasada sobre el texto para todas las palabras clave (como subcadenas, igual que `in`)
+_ACTION_RE = re.compile('|'.join(re.escape(k) for k in sorted(_ACTION_KEYWORDS, key=len, reverse=True)))
+_STOP_WORDS = frozenset({
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'has',
+    'una', 'para', 'con', 'por', 'los', 'las', 'del', 'que', 'como', 'sus'
+})
+
+
+def _ratio(norm1, norm2):
+    """Ratio de similitud (0.0 a 1.0) entre dos textos ya normalizados."""
+    if fuzz is not None:
+        return fuzz.ratio(norm1, norm2) / 100.0
+    return SequenceMatcher(None, norm1, norm2).ratio()
+
+
+def _ratios(norm, others, score_cutoff=0.0):
+    """
+    _ratio de `norm` contra cada texto de `others`, en una sola llamada a rapidfuzz si está disponible.
+    Los ratios por debajo de score_cutoff se devuelven como 0.0 (rapidfuzz corta antes el cálculo;
+    con difflib se descartan con las cotas baratas real_quick_ratio/quick_ratio).
+    """
+    if not others:
+        return []
+    if process is not None:
+        scores = process.cdist([norm], others, scorer=fuzz.ratio, score_cutoff=score_cutoff * 100)[0]
+        return [float(score) / 100.0 for score in scores]
+    ratios = []
+    matcher = SequenceMatcher(None, norm)
+    for other in others:
+        matcher.set_seq2(other)
+        if matcher.real_quick_ratio() < score_cutoff or matcher.quick_ratio() < score_cutoff:
+            ratios.append(0.0)
+        else:
+            ratios.append(matcher.ratio())
+    return ratios
 
 
 def normalize_text(text):
@@ -37,28 +91,24 @@ def normalize_text(text):
     text = text.lower()
 
     # Eliminar URLs
-    text = re.sub(r'http[s]?://\S+', '', text)
+    text = _URL_RE.sub('', text)
 
     # Eliminar puntuación y caracteres especiales (mantener espacios)
-    text = re.sub(r'[^\w\s]', ' ', text)
+    text = _PUNCT_RE.sub(' ', text)
 
     # Eliminar números solos (pero mantener números dentro de palabras como "5G")
-    text = re.sub(r'\b\d+\b', '', text)
+    text = _NUM_RE.sub('', text)
 
     # Eliminar palabras muy cortas (artículos, preposiciones)
     words = text.split()
     words = [w for w in words if len(w) > 2]
 
     # Eliminar stop words comunes en español e inglés
-    stop_words = {
-        'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'has',
-        'una', 'para', 'con', 'por', 'los', 'las', 'del', 'que', 'como', 'sus'
-    }
-    words = [w for w in words if w not in stop_words]
+    words = [w for w in words if w not in _STOP_WORDS]
 
     # Unir palabras y eliminar espacios múltiples
     normalized = ' '.join(words)
-    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    normalized = _WS_RE.sub(' ', normalized).strip()
 
     return normalized
 
@@ -75,23 +125,12 @@ def extract_key_entities(text):
     """
     entities = set()
 
-    # Patrón para nombres de empresas (palabras capitalizadas consecutivas)
-    # Ejemplo: "Banco Santander", "Microsoft Corporation"
-    company_pattern = r'\b([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+){0,3})\b'
-    companies = re.findall(company_pattern, text)
+    # Nombres de empresas (palabras capitalizadas consecutivas), ver _COMPANY_RE
+    companies = _COMPANY_RE.findall(text)
     entities.update([c.lower() for c in companies if len(c) > 4])
 
-    # Palabras clave de acción (M&A, inversión, expansión, etc.)
-    action_keywords = [
-        'adquisición', 'fusión', 'inversión', 'expansión', 'lanzamiento',
-        'acquisition', 'merger', 'investment', 'expansion', 'launch',
-        'venture', 'partnership', 'transformación', 'digital'
-    ]
-
-    text_lower = text.lower()
-    for keyword in action_keywords:
-        if keyword in text_lower:
-            entities.add(keyword)
+    # Palabras clave de acción (M&A, inversión, expansión, etc.), ver _ACTION_RE
+    entities.update(_ACTION_RE.findall(text.lower()))
 
     return entities
 
@@ -105,7 +144,7 @@ def create_content_fingerprint(headline, company_name=None):
         company_name (str, optional): Nombre de la empresa
 
     Returns:
-        str: Hash MD5 del contenido normalizado
+        str: Hash BLAKE2b (64 bits, 16 caracteres hex) del contenido normalizado
     """
     # Normalizar headline
     normalized_headline = normalize_text(headline)
@@ -123,15 +162,15 @@ def create_content_fingerprint(headline, company_name=None):
     sorted_entities = sorted(entities)
     combined = normalized_headline + ' ' + ' '.join(sorted_entities)
 
-    # Crear hash MD5
-    fingerprint = hashlib.md5(combined.encode('utf-8')).hexdigest()
+    # Hash no criptográfico: BLAKE2b de 8 bytes (stdlib, más rápido que MD5)
+    fingerprint = hashlib.blake2b(combined.encode('utf-8'), digest_size=8).hexdigest()
 
     return fingerprint
 
 
 def calculate_text_similarity(text1, text2):
     """
-    Calcula la similitud entre dos textos usando SequenceMatcher.
+    Calcula la similitud entre dos textos (rapidfuzz si está instalado, si no SequenceMatcher).
 
     Args:
         text1 (str): Primer texto
@@ -148,9 +187,43 @@ def calculate_text_similarity(text1, text2):
     norm2 = normalize_text(text2)
 
     # Calcular similitud
-    similarity = SequenceMatcher(None, norm1, norm2).ratio()
+    return _ratio(norm1, norm2)
 
-    return similarity
+
+def _dedup_features(headline, company_name=None):
+    """
+    Texto normalizado, entidades y empresa normalizada de un titular, tal y como
+    los compara check_content_similarity.
+
+    Returns:
+        tuple: (headline_normalizado, frozenset de entidades, empresa_normalizada)
+    """
+    entities = extract_key_entities(headline or '')
+    company_normalized = ''
+    if company_name:
+        # Normalizar y agregar variaciones del nombre de la empresa
+        company_normalized = normalize_text(company_name)
+        entities.add(company_normalized)
+        # Agregar también la primera palabra (ej: "Santander" de "Banco Santander")
+        company_first_word = company_normalized.split()[0] if company_normalized else ''
+        if len(company_first_word) > 3:
+            entities.add(company_first_word)
+    return normalize_text(headline), frozenset(entities), company_normalized
+
+
+def _opportunity_features(opp):
+    """
+    _dedup_features de una oportunidad existente, cacheado en el propio dict
+    (clave '_dedup_features') para que las comprobaciones siguientes del ciclo
+    contra la misma oportunidad no vuelvan a normalizar ni extraer entidades.
+    """
+    headline = opp.get('headline', '')
+    company_name = opp.get('company_name', '')
+    cached = opp.get('_dedup_features')
+    if cached is None or cached[0] != (headline, company_name):
+        cached = ((headline, company_name), _dedup_features(headline, company_name))
+        opp['_dedup_features'] = cached
+    return cached[1]
 
 
 def check_content_similarity(new_headline, new_company, recent_opportunities, similarity_threshold=0.70):
@@ -166,44 +239,35 @@ def check_content_similarity(new_headline, new_company, recent_opportunities, si
     Returns:
         tuple: (is_duplicate: bool, similar_to: dict or None)
     """
-    new_normalized = normalize_text(new_headline)
-    new_entities = extract_key_entities(new_headline)
+    new_normalized, new_entities, new_company_normalized = _dedup_features(new_headline, new_company)
 
-    if new_company:
-        # Normalizar y agregar variaciones del nombre de la empresa
-        company_normalized = normalize_text(new_company)
-        new_entities.add(company_normalized)
-        # Agregar también la primera palabra (ej: "Santander" de "Banco Santander")
-        company_first_word = company_normalized.split()[0] if company_normalized else ''
-        if len(company_first_word) > 3:
-            new_entities.add(company_first_word)
+    recent_opportunities = list(recent_opportunities)
+    opp_features = [_opportunity_features(opp) for opp in recent_opportunities]
+    # Similitud de texto contra todas las oportunidades de una vez. Por debajo del menor umbral
+    # que usan las reglas 2 y 3 (0.45 solo aplica si hay empresa) el valor exacto no importa
+    score_cutoff = min(similarity_threshold, 0.45) if new_company else similarity_threshold
+    text_similarities = _ratios(new_normalized, [features[0] for features in opp_features], score_cutoff)
 
-    for opp in recent_opportunities:
+    for opp, features, text_similarity in zip(recent_opportunities, opp_features, text_similarities):
         opp_headline = opp.get('headline', '')
         opp_company = opp.get('company_name', '')
-
-        # Preparar entidades de la oportunidad existente
-        opp_entities = extract_key_entities(opp_headline)
-        if opp_company:
-            opp_company_normalized = normalize_text(opp_company)
-            opp_entities.add(opp_company_normalized)
-            opp_company_first_word = opp_company_normalized.split()[0] if opp_company_normalized else ''
-            if len(opp_company_first_word) > 3:
-                opp_entities.add(opp_company_first_word)
+        opp_normalized, opp_entities, opp_company_normalized = features
 
         # REGLA 1: Verificar si la empresa principal es la misma (fuzzy match)
         company_match = False
         if new_company and opp_company:
             # Match exacto normalizado
-            if normalize_text(new_company) == normalize_text(opp_company):
+            if new_company_normalized == opp_company_normalized:
                 company_match = True
             # Match parcial (ej: "Santander" está en "Banco Santander")
-            elif (normalize_text(new_company) in normalize_text(opp_company) or
-                  normalize_text(opp_company) in normalize_text(new_company)):
+            elif (new_company_normalized in opp_company_normalized or
+                  opp_company_normalized in new_company_normalized):
                 company_match = True
 
         # REGLA 2: Similitud de texto alta (75%+)
-        text_similarity = calculate_text_similarity(new_headline, opp_headline)
+        # Equivale a calculate_text_similarity pero con los textos ya normalizados
+        if not new_headline or not opp_headline:
+            text_similarity = 0.0
 
         if text_similarity >= similarity_threshold:
             return True, {
@@ -223,9 +287,13 @@ def check_content_similarity(new_headline, new_company, recent_opportunities, si
             }
 
         # REGLA 4: Entidades clave compartidas
-        if len(new_entities) > 0 and len(opp_entities) > 0:
-            shared_entities = new_entities.intersection(opp_entities)
-            entity_overlap_ratio = len(shared_entities) / max(len(new_entities), len(opp_entities))
+        # Cota superior del solapamiento (min/max de tamaños): si ni así llega al umbral,
+        # no hace falta construir la intersección
+        largest = max(len(new_entities), len(opp_entities))
+        min_overlap = 0.5 if company_match else 0.70
+        if largest and min(len(new_entities), len(opp_entities)) >= min_overlap * largest:
+            shared_entities = new_entities & opp_entities
+            entity_overlap_ratio = len(shared_entities) / largest
 
             # Si comparten empresa + otras entidades clave (acción, país), es duplicado
             if company_match and entity_overlap_ratio >= 0.5:
@@ -252,6 +320,77 @@ def check_content_similarity(new_headline, new_company, recent_opportunities, si
     return False, None
 
 
+class RecentOpportunityIndex:
+    """
+    Índice invertido (token normalizado / entidad -> oportunidades) sobre las
+    oportunidades recientes.
+
+    check_content_similarity compara contra toda la lista; con el índice solo se
+    comparan las candidatas:
+    - las que comparten al menos un token o entidad con el titular nuevo (sin
+      ninguna entidad en común las reglas de entidades no pueden dispararse), y
+    - las que alcanzan el menor umbral de similitud de texto de las reglas 2 y 3.
+      El ratio es por caracteres y puede superarse sin compartir ninguna palabra
+      entera ("santanders compras" vs "santander compra"), así que se calcula
+      contra todos los titulares en una sola llamada vectorizada.
+    Con los umbrales por defecto el resultado es el mismo que con la lista completa.
+    """
+
+    def __init__(self, opportunities=(), url_key=None):
+        self._opportunities = []
+        self._normalized = []  # Titular normalizado de cada oportunidad, para el ratio
+        self._postings = defaultdict(set)
+        self._url_key = url_key or (lambda url: url)  # p.ej. canonicalize_url del agente
+        self._urls = set()
+        for opp in opportunities:
+            self.add(opp)
+
+    def __len__(self):
+        return len(self._opportunities)
+
+    def __contains__(self, url):
+        """Comprobación O(1) de si una URL ya está entre las oportunidades recientes."""
+        return bool(url) and self._url_key(url) in self._urls
+
+    @staticmethod
+    def _index_keys(features):
+        """Claves de posting a partir de las _dedup_features de un titular."""
+        normalized, entities, company_normalized = features
+        keys = set(normalized.split())
+        keys.update(entities)
+        keys.update(company_normalized.split())
+        return keys
+
+    def add(self, opportunity):
+        """Añade una oportunidad (dict con 'headline' y opcionalmente 'company_name')."""
+        position = len(self._opportunities)
+        self._opportunities.append(opportunity)
+        if opportunity.get('source_url'):
+            self._urls.add(self._url_key(opportunity['source_url']))
+        # _opportunity_features deja cacheado en el dict lo que luego usa check_content_similarity
+        features = _opportunity_features(opportunity)
+        self._normalized.append(features[0] if opportunity.get('headline') else '')
+        for key in self._index_keys(features):
+            self._postings[key].add(position)
+
+    def candidates(self, headline, company_name=None, similarity_threshold=0.70):
+        """
+        Oportunidades que comparten algún token o entidad con el titular o cuyo
+        texto alcanza el umbral de similitud (el de check_content_similarity, o
+        0.45 si hay empresa), en el orden en que se añadieron.
+        """
+        features = _dedup_features(headline, company_name)
+        positions = set()
+        for key in self._index_keys(features):
+            positions.update(self._postings.get(key, ()))
+        if headline:
+            score_cutoff = min(similarity_threshold, 0.45) if company_name else similarity_threshold
+            ratios = _ratios(features[0], self._normalized, score_cutoff)
+            positions.update(i for i, ratio in enumerate(ratios)
+                             if ratio >= score_cutoff and self._normalized[i])
+        return [self._opportunities[i] for i in sorted(positions)]
+
+
 def is_duplicate_opportunity(new_headline, new_company, recent_opportunities, days_lookback=7):
     """
     Función principal: verifica si una nueva oportunidad es duplicada.
@@ -260,22 +399,42 @@ def is_duplicate_opportunity(new_headline, new_company, recent_opportunities, da
         new_headline (str): Titular del nuevo artículo
         new_company (str): Nombre de la empresa
         recent_opportunities (list): Lista de oportunidades recientes de la DB
-        days_lookback (int): Días hacia atrás para buscar duplicados (default: 7)
+        days_lookback (int or None): Días hacia atrás para buscar duplicados (default: 7).
+            None si recent_opportunities ya viene filtrada por fecha
+            (get_recent_opportunities filtra en SQL).
 
     Returns:
         tuple: (is_duplicate: bool, duplicate_info: dict or None)
     """
-    # Filtrar oportunidades por fecha (últimos N días)
+    if days_lookback is None:
+        filtered_opps = recent_opportunities
+    else:
+        filtered_opps = _filter_by_date(recent_opportunities, days_lookback)
+
+    # Verificar similitud de contenido
+    return check_content_similarity(
+        new_headline=new_headline,
+        new_company=new_company,
+        recent_opportunities=filtered_opps,
+        similarity_threshold=0.75
+    )
+
+
+def _filter_by_date(recent_opportunities, days_lookback):
+    """Oportunidades de los últimos days_lookback días (las que no tienen fecha válida se incluyen)."""
     cutoff_date = datetime.now() - timedelta(days=days_lookback)
 
     filtered_opps = []
     for opp in recent_opportunities:
         # Si tiene fecha de notificación, usarla; sino, usar created_at
-        opp_date_str = opp.get('notified_at') or opp.get('created_at')
-        if opp_date_str:
+        opp_date = opp.get('notified_at') or opp.get('created_at')
+        if isinstance(opp_date, datetime):
+            # Filas de la DB: ya vienen como datetime (PARSE_DECLTYPES)
+            if opp_date >= cutoff_date:
+                filtered_opps.append(opp)
+        elif opp_date:
             try:
-                opp_date = datetime.fromisoformat(opp_date_str)
-                if opp_date >= cutoff_date:
+                if datetime.fromisoformat(opp_date) >= cutoff_date:
                     filtered_opps.append(opp)
             except (ValueError, TypeError):
                 # Si hay error parseando fecha, incluir la oportunidad por seguridad
@@ -283,14 +442,7 @@ def is_duplicate_opportunity(new_headline, new_company, recent_opportunities, da
         else:
             # Sin fecha, incluir por seguridad
             filtered_opps.append(opp)
-
-    # Verificar similitud de contenido
-    return check_content_similarity(
-        new_headline=new_headline,
-        new_company=new_company,
-        recent_opportunities=filtered_opps,
-        similarity_threshold=0.75
-    )
+    return filtered_opps
 
 
 if __name__ == '__main__':
@@ -1,9 +1,22 @@
+import argparse
 import sqlite3
+from pathlib import Path
 
-db_path = 'c:/Users/VictorMontesa/projects/agents/hunter-agentv2/opportunities.db'
+import database
+
+parser = argparse.ArgumentParser(description="Print tables, schemas and a sample row of the opportunities DB.")
+parser.add_argument('--db', default=database.DB_NAME, help="DB path; ':memory:' inspects a fresh in-memory schema (dry run)")
+args = parser.parse_args()
 
 try:
-    conn = sqlite3.connect(db_path)
+    if args.db == ':memory:':
+        # Ephemeral DB with the current schema: no disk I/O
+        database.initialize_db(db=':memory:')
+        conn = database.get_connection()
+    else:
+        # Read-only URI: can't create the file or write, and doesn't block the agent's WAL writer
+        conn = sqlite3.connect(Path(args.db).resolve().as_uri() + '?mode=ro', uri=True)
+        conn.execute('PRAGMA mmap_size=268435456')  # 256 MB: read pages via mmap instead of read()
     cursor = conn.cursor()
     
     # List tables
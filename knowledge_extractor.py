@@ -4,52 +4,32 @@ Extracts compact, actionable rules from ALL feedback examples
 instead of using raw examples in prompts.
 """
 import os
+import re
 import json
+import hashlib
 import google.generativeai as genai
 from dotenv import load_dotenv
+try:
+    import orjson  # Optional: faster JSON parsing/serialization
+except ImportError:
+    orjson = None
 from database import get_all_feedback_examples
 
 load_dotenv()
 genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 
-def distill_feedback_to_rules():
-    """
-    Analyzes ALL feedback examples and distills them into compact rules.
-    Returns a structured set of criteria that can be used in prompts.
-    """
-    # Get ALL feedback (no limits - we want complete knowledge)
-    feedback = get_all_feedback_examples(limit_per_category=1000)
-
-    if not feedback['relevant'] and not feedback['irrelevant']:
-        return None
-
-    # Build comprehensive context for AI to analyze
-    relevant_text = "\n".join([
-        f"- {ex['headline']} | Razón: {ex['rationale'] or 'N/A'}"
-        for ex in feedback['relevant']
-    ])
-
-    irrelevant_text = "\n".join([
-        f"- {ex['headline']} | Razón: {ex['rationale'] or 'N/A'}"
-        for ex in feedback['irrelevant']
-    ])
-
-    # Use AI to extract patterns and create compact rules
-    distillation_prompt = f"""
+# Task description and JSON schema for distill_feedback_to_rules. Kept constant and
+# placed before the (changing) feedback examples so it can be served from prompt cache.
+_DISTILL_STATIC_PREFIX = """
     Eres un analista experto que debe extraer patrones de feedback de usuarios.
 
     OBJETIVO: Analizar TODO el feedback histórico y crear una LISTA COMPACTA de criterios
     de tipo SÍ/NO que permitan clasificar oportunidades sin necesidad de ver todos los ejemplos.
 
-    EJEMPLOS MARCADOS COMO RELEVANTES ({len(feedback['relevant'])} total):
-    {relevant_text}
-
-    EJEMPLOS MARCADOS COMO IRRELEVANTES ({len(feedback['irrelevant'])} total):
-    {irrelevant_text}
-
-    TAREA: Extrae patrones y crea una lista compacta de criterios. Responde SOLO con JSON:
+    TAREA: Extrae patrones de los ejemplos que aparecen al final y crea una lista compacta
+    de criterios. Responde SOLO con JSON:
 
-    {{
+    {
         "must_have_criteria": [
             "Lista de características que DEBE tener una oportunidad relevante",
             "Ejemplo: Menciona empresa específica con nombre propio",
@@ -80,32 +60,107 @@ def distill_feedback_to_rules():
             "Ejemplo: PRIORIDAD 1: México, España, Portugal",
             "Ejemplo: EXCLUIR: Europa del Este, Medio Oriente (salvo excepciones)"
         ]
-    }}
+    }
 
     IMPORTANTE: Cada criterio debe ser conciso (máximo 15 palabras). Extrae los patrones
     más importantes que se repiten en el feedback.
+"""
+
+
+_format_example = "- {} | Razón: {}".format
+
+# Optional ```/```json markdown fence around the model's JSON answer
+_FENCE_RE = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+
+def _format_examples(examples):
+    """One '- headline | Razón: rationale' line per feedback example."""
+    return "\n".join(_format_example(ex['headline'], ex['rationale'] or 'N/A') for ex in examples)
+
+
+def feedback_hash(feedback):
+    """
+    sha256 of the (headline, rationale, label) tuples of a feedback set.
+    Order-independent, so it only changes when the feedback itself changes.
     """
+    entries = sorted(
+        (ex['headline'] or '', ex['rationale'] or '', label)
+        for label, examples in feedback.items()
+        for ex in examples
+    )
+    return hashlib.sha256(json.dumps(entries, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def distill_feedback_to_rules(feedback=None, force=False, filepath='distilled_rules.json'):
+    """
+    Analyzes ALL feedback examples and distills them into compact rules.
+    Returns a structured set of criteria that can be used in prompts.
+
+    If the rules cached in `filepath` were distilled from the same feedback
+    (same feedback_hash in their metadata), they are returned without calling
+    the model. Pass force=True to distill again anyway.
+    """
+    # Get ALL feedback (no limits - we want complete knowledge)
+    if feedback is None:
+        feedback = get_all_feedback_examples(limit_per_category=1000)
+
+    if not feedback['relevant'] and not feedback['irrelevant']:
+        return None
+
+    current_hash = feedback_hash(feedback)
+    if not force:
+        cached = load_distilled_rules(filepath)
+        if cached and cached.get('metadata', {}).get('feedback_hash') == current_hash:
+            print("Feedback unchanged since last distillation: using cached rules.")
+            return cached
+
+    # Build comprehensive context for AI to analyze.
+    # Oldest first (the DB returns newest first) so new feedback is appended at the end
+    relevant_text = _format_examples(reversed(feedback['relevant']))
+    irrelevant_text = _format_examples(reversed(feedback['irrelevant']))
+
+    # Static instructions first, feedback last: the prefix is identical on every run
+    # (provider-side prefix caching) and only the tail changes as feedback grows
+    distillation_prompt = (
+        _DISTILL_STATIC_PREFIX
+        + f"""
+    EJEMPLOS MARCADOS COMO RELEVANTES ({len(feedback['relevant'])} total):
+    {relevant_text}
+
+    EJEMPLOS MARCADOS COMO IRRELEVANTES ({len(feedback['irrelevant'])} total):
+    {irrelevant_text}
+    """
+    )
 
     try:
         model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(distillation_prompt)
+        # Stream the response (progress while the model generates) and ask for plain JSON
+        response = model.generate_content(
+            distillation_prompt,
+            generation_config={"response_mime_type": "application/json"},
+            stream=True
+        )
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk.text)
+            print(f"\r  ...received {sum(map(len, chunks))} chars", end="", flush=True)
+        print()
 
         # Extract JSON from response
-        json_text = response.text.strip()
+        json_text = "".join(chunks).strip()
         # Remove markdown code blocks if present
-        if json_text.startswith('```'):
-            json_text = json_text.split('```')[1]
-            if json_text.startswith('json'):
-                json_text = json_text[4:]
-        json_text = json_text.strip()
+        fence = _FENCE_RE.match(json_text)
+        if fence:
+            json_text = fence.group(1)
 
-        rules = json.loads(json_text)
+        rules = orjson.loads(json_text) if orjson else json.loads(json_text)
 
         # Add metadata
         rules['metadata'] = {
             'total_relevant_examples': len(feedback['relevant']),
             'total_irrelevant_examples': len(feedback['irrelevant']),
-            'distilled_from': len(feedback['relevant']) + len(feedback['irrelevant'])
+            'distilled_from': len(feedback['relevant']) + len(feedback['irrelevant']),
+            'feedback_hash': current_hash
         }
 
         return rules
@@ -115,59 +170,54 @@ def distill_feedback_to_rules():
         return None
 
 
+# (rules key, section header) in prompt order
+_RULE_SECTIONS = (
+    ('must_have_criteria', "✅ **DEBE TENER (requisitos obligatorios):**\n"),
+    ('must_not_have_criteria', "❌ **NO DEBE TENER (descalificadores automáticos):**\n"),
+    ('positive_signals', "⭐ **SEÑALES POSITIVAS:**\n"),
+    ('red_flags', "🚩 **SEÑALES DE ALARMA:**\n"),
+    ('geographic_rules', "🌍 **REGLAS GEOGRÁFICAS:**\n"),
+    ('industry_patterns', "🏭 **PATRONES POR INDUSTRIA:**\n"),
+)
+
+
 def format_rules_for_prompt(rules):
     """
     Formats distilled rules into a compact string for injection into prompts.
+    Uses the 'formatted' string persisted by save_distilled_rules when present.
     """
     if not rules:
         return ""
-
-    formatted = "\n**CRITERIOS EXTRAÍDOS DE TODO EL FEEDBACK HISTÓRICO**\n"
-    formatted += f"(Basado en {rules['metadata']['distilled_from']} ejemplos analizados)\n\n"
-
-    if rules.get('must_have_criteria'):
-        formatted += "✅ **DEBE TENER (requisitos obligatorios):**\n"
-        for criterion in rules['must_have_criteria']:
-            formatted += f"  • {criterion}\n"
-        formatted += "\n"
-
-    if rules.get('must_not_have_criteria'):
-        formatted += "❌ **NO DEBE TENER (descalificadores automáticos):**\n"
-        for criterion in rules['must_not_have_criteria']:
-            formatted += f"  • {criterion}\n"
-        formatted += "\n"
-
-    if rules.get('positive_signals'):
-        formatted += "⭐ **SEÑALES POSITIVAS:**\n"
-        for signal in rules['positive_signals']:
-            formatted += f"  • {signal}\n"
-        formatted += "\n"
-
-    if rules.get('red_flags'):
-        formatted += "🚩 **SEÑALES DE ALARMA:**\n"
-        for flag in rules['red_flags']:
-            formatted += f"  • {flag}\n"
-        formatted += "\n"
-
-    if rules.get('geographic_rules'):
-        formatted += "🌍 **REGLAS GEOGRÁFICAS:**\n"
-        for rule in rules['geographic_rules']:
-            formatted += f"  • {rule}\n"
-        formatted += "\n"
-
-    if rules.get('industry_patterns'):
-        formatted += "🏭 **PATRONES POR INDUSTRIA:**\n"
-        for pattern in rules['industry_patterns']:
-            formatted += f"  • {pattern}\n"
-
-    return formatted
+    if rules.get('formatted'):
+        return rules['formatted']
+    return _build_rules_prompt(rules)
+
+
+def _build_rules_prompt(rules):
+    """Builds the prompt block for a set of distilled rules."""
+    parts = [
+        "\n**CRITERIOS EXTRAÍDOS DE TODO EL FEEDBACK HISTÓRICO**\n",
+        f"(Basado en {rules['metadata']['distilled_from']} ejemplos analizados)\n\n",
+    ]
+    for key, title in _RULE_SECTIONS:
+        if rules.get(key):
+            parts.append(title)
+            parts.extend(f"  • {item}\n" for item in rules[key])
+            if key != 'industry_patterns':  # last section: no trailing blank line
+                parts.append("\n")
+    return "".join(parts)
 
 
 def save_distilled_rules(rules, filepath='distilled_rules.json'):
-    """Save distilled rules to file for caching."""
+    """Save distilled rules to file for caching, with their prompt block under 'formatted'."""
     if rules:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(rules, f, indent=2, ensure_ascii=False)
+        rules['formatted'] = _build_rules_prompt(rules)
+        if orjson:
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(rules, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(rules, f, indent=2, ensure_ascii=False)
         print(f"✅ Distilled rules saved to {filepath}")
 
 
@@ -175,6 +225,9 @@ def load_distilled_rules(filepath='distilled_rules.json'):
     """Load cached distilled rules from file."""
     try:
         if os.path.exists(filepath):
+            if orjson:
+                with open(filepath, 'rb') as f:
+                    return orjson.loads(f.read())
             with open(filepath, 'r', encoding='utf-8') as f:
                 return json.load(f)
     except Exception as e:
@@ -192,8 +245,8 @@ if __name__ == "__main__":
     print(f"\n📊 Analyzing {len(feedback['relevant'])} relevant + {len(feedback['irrelevant'])} irrelevant examples")
     print("🔄 Distilling knowledge using AI...\n")
 
-    # Distill into rules
-    rules = distill_feedback_to_rules()
+    # Distill into rules (reuses distilled_rules.json if the feedback hasn't changed)
+    rules = distill_feedback_to_rules(feedback)
 
     if rules:
         # Save for future use
@@ -209,11 +262,12 @@ if __name__ == "__main__":
         print("✅ SUCCESS: All feedback condensed into compact criteria")
         print("=" * 80)
         print(f"\nOriginal: {rules['metadata']['distilled_from']} examples")
-        print(f"Condensed to: {sum(len(v) for k,v in rules.items() if k != 'metadata')} criteria")
+        criteria_count = sum(len(v) for k, v in rules.items() if k not in ('metadata', 'formatted'))
+        print(f"Condensed to: {criteria_count} criteria")
 
         # Calculate token savings
         original_tokens = rules['metadata']['distilled_from'] * 50  # Estimate
-        condensed_tokens = sum(len(v) for k,v in rules.items() if k != 'metadata') * 15  # Estimate
+        condensed_tokens = criteria_count * 15  # Estimate
         print(f"\nEstimated token reduction: {original_tokens} → {condensed_tokens}")
         print(f"Savings: {100 - (condensed_tokens/original_tokens*100):.1f}%")
     else:
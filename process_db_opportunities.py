@@ -2,7 +2,9 @@ import sqlite3
 import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
 # Ensure we can import from the search path
@@ -11,23 +13,58 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from agent import (
     get_combined_analysis_prompt, 
     analyze_text_with_ai,
-    pre_filter_content,
+    json_loads,
+    json_dumps,
+    pre_filter_contents,
     load_ml_model,
     MODEL_ROTATION,
+    MODEL_SCHEDULE,
+    MODEL_RATE_LIMITERS,
     ML_FILTER_THRESHOLD,
-    RATE_LIMIT_SLEEP,
-    TOTAL_DAILY_LIMIT
+    TOTAL_DAILY_LIMIT,
+    TokenBucket
 )
 from slack_notifier import send_slack_notification
-from database import DB_NAME, mark_as_notified, save_analysis, initialize_db
+from database import (DB_NAME, save_analysis, initialize_db, update_status_bulk, transition,
+                      REQUIRED_ANALYSIS_FIELDS)
 
 load_dotenv()
 
+# Campos REQUERIDOS para el formato rico de Slack
+REQUIRED_FIELDS = REQUIRED_ANALYSIS_FIELDS
+
+# Country inferred from the URL's top-level domain when the row has none
+TLD_COUNTRY = {'es': 'es', 'mx': 'mx', 'pt': 'pt', 'br': 'pt', 'cl': 'cl', 'co': 'co', 'pe': 'pe', 'ar': 'ar'}
+
+# Status-only updates (ml_filtered / legacy_skip) are written in batches of this size
+STATUS_FLUSH_EVERY = 50
+
+# Concurrent Gemini calls; each one still waits for its model's slot in MODEL_RATE_LIMITERS
+ANALYSIS_WORKERS = 4
+# Slack notifications: chat.postMessage allows ~1 msg/s per channel. Monotonic deadline, so the
+# time spent sending (and analyzing) counts towards the gap instead of a fixed pause after each send
+SLACK_MESSAGES_PER_MINUTE = 60
+SLACK_RATE_LIMITER = TokenBucket(SLACK_MESSAGES_PER_MINUTE)
+
+def missing_required_fields(analysis):
+    """REQUIRED_FIELDS ausentes o vacíos en un análisis ya parseado (todos si no es un objeto JSON)."""
+    if not isinstance(analysis, dict):
+        return list(REQUIRED_FIELDS)
+    return [f for f in REQUIRED_FIELDS if not analysis.get(f)]
+
+def analyze_opportunity(content, source_type, model_name):
+    """Runs on the analysis pool: waits for the model's rate-limit slot, then calls Gemini."""
+    MODEL_RATE_LIMITERS[model_name].acquire()
+    prompt = get_combined_analysis_prompt(content, source_type)
+    return analyze_text_with_ai(prompt, model_name=model_name)
+
 def process_opportunities():
     """
     Reads opportunities with status='detected' from the database,
     ensures they are analyzed, sends them to the correct regional Slack channel,
     and updates their status to 'notified'.
+    Rows that need AI analysis are analyzed concurrently (ANALYSIS_WORKERS) and
+    notified as their results arrive.
     """
     print("Starting processing of detected opportunities...")
     print(f"  -> Model rotation: {len(MODEL_ROTATION)} models, {TOTAL_DAILY_LIMIT} max calls")
@@ -47,22 +84,19 @@ def process_opportunities():
     api_call_counter = 0
     
     def get_current_model():
-        """Returns the current model based on api_call_counter"""
-        nonlocal api_call_counter
-        calls_made = 0
-        for model_config in MODEL_ROTATION:
-            if api_call_counter < calls_made + model_config["limit"]:
-                return model_config["name"]
-            calls_made += model_config["limit"]
+        """Returns the current model based on api_call_counter (precomputed MODEL_SCHEDULE lookup)"""
+        if api_call_counter < len(MODEL_SCHEDULE):
+            return MODEL_SCHEDULE[api_call_counter]
         return None  # All models exhausted
     
+    conn = None
     try:
         conn = sqlite3.connect(DB_NAME)
         cursor = conn.cursor()
         
         # Get detected opportunities that haven't been notified yet
         cursor.execute("""
-            SELECT id, source_url, content, source_type, country, analysis_json, headline 
+            SELECT id, source_url, content, source_type, country, analysis_json, headline, schema_ok 
             FROM opportunities 
             WHERE status IN ('detected', 'analyzed')
         """)
@@ -73,121 +107,196 @@ def process_opportunities():
         processed_count = 0
         error_count = 0
         ml_filtered_count = 0
+        # Cambios de estado sin efectos externos: se escriben juntos al final (un commit)
+        ml_filtered_ids = []
+        legacy_skip_ids = []
+
+        def flush_status_updates():
+            """Writes the accumulated status changes (one transaction per status) and clears them."""
+            update_status_bulk(ml_filtered_ids, 'ml_filtered')
+            update_status_bulk(legacy_skip_ids, 'legacy_skip')
+            ml_filtered_ids.clear()
+            legacy_skip_ids.clear()
         
+        # Stored analyses not yet validated (schema_ok): parsed once, reused by the ML pre-filter
+        # and by the main loop. None = invalid JSON
+        stored_analyses = {}
         for row in rows:
-            opp_id, url, content, source_type, country, analysis_json_str, headline = row
+            if not row[7] and row[5]:
+                try:
+                    stored_analyses[row[0]] = json_loads(row[5])
+                except json.JSONDecodeError:
+                    stored_analyses[row[0]] = None
+        
+        # ML Pre-filter: score every row that will need AI analysis in a single batch
+        ml_verdicts = {}
+        if ml_model:
+            to_score = [(row[0], row[2]) for row in rows
+                        if row[2] and not (row[7] or (row[5] and not missing_required_fields(stored_analyses[row[0]])))]
+            if to_score:
+                print(f"  -> ML pre-filter: scoring {len(to_score)} items in one batch...")
+                config = {}  # Empty config, we're not using regex filter here
+                verdicts = pre_filter_contents([content for _, content in to_score], config)
+                ml_verdicts = {opp_id: passed for (opp_id, _), passed in zip(to_score, verdicts)}
+        
+        def notify(opp_id, url, country, notification_json, new_analysis_json=None, analysis=None):
+            """Sends one Slack notification and records the outcome. Returns True on success.
+            `analysis` is the already-parsed dict when the caller has it (skips a json.loads)."""
+            SLACK_RATE_LIMITER.acquire()  # Slack allows ~1 msg/s; only waits if the last send was recent
+            success = send_slack_notification(
+                analysis_json_str=notification_json,
+                source_url=url,
+                country=country,
+                analysis=analysis
+            )
+            
+            if success:
+                # Estado, fecha de notificación y (si es nuevo) análisis en un solo UPDATE
+                fields = {'notified_at': datetime.now()}
+                if new_analysis_json:
+                    fields.update(trigger_event="ManualProcess", score=0.0, analysis_json=new_analysis_json,
+                                  processed_at=datetime.now(), schema_ok=1)
+                transition(opp_id, 'notified', **fields)
+                print("  -> SUCCESS: Notification sent and marked as notified.")
+            else:
+                print("  -> FAILED: Could not send Slack notification.")
+                if new_analysis_json:
+                    # Conservar el análisis para reintentar la notificación sin volver a llamar a la IA
+                    save_analysis(opp_id, "ManualProcess", 0.0, new_analysis_json)
+                    print("  -> Analysis saved for retry.")
+            return success
+        
+        # Rows that need a Gemini call: (opp_id, url, country, headline, content, source_type, model)
+        to_analyze = []
+        # Rows past the budget (same tuple, no model): analyzed if failed calls give their slot back
+        over_budget = []
+        budget_exhausted = False
+        
+        for row in rows:
+            opp_id, url, content, source_type, country, analysis_json_str, headline, schema_ok = row
+            if len(ml_filtered_ids) + len(legacy_skip_ids) >= STATUS_FLUSH_EVERY:
+                flush_status_updates()
             
             # Helper to infer country if missing
             if not country and url:
                 try:
-                    from urllib.parse import urlparse
-                    domain = urlparse(url).netloc
-                    if domain.endswith('.es'): country = 'es'
-                    elif domain.endswith('.mx'): country = 'mx'
-                    elif domain.endswith('.pt') or domain.endswith('.br'): country = 'pt'
-                    elif domain.endswith('.cl'): country = 'cl'
-                    elif domain.endswith('.co'): country = 'co'
-                    elif domain.endswith('.pe'): country = 'pe'
-                    elif domain.endswith('.ar'): country = 'ar'
+                    _, dot, tld = urlparse(url).netloc.rpartition('.')
+                    if dot:
+                        country = TLD_COUNTRY.get(tld)
                 except:
                     pass
 
             print(f"\nProcessing Opportunity ID {opp_id}: {headline[:50]}...")
             print(f"  -> Country: {country if country else 'Unknown (sending to default)'}")
             
+            notification_json = None  # JSON que se envía a Slack
             analysis_result = None
-            is_valid_for_notification = False
-            
-            # Campos REQUERIDOS para el formato rico de Slack
-            REQUIRED_FIELDS = ['company_name', 'opportunity_summary', 'igeneris_fit', 'proposed_solution', 'value_proposition']
             
             # 1. Try to use existing analysis
-            if analysis_json_str:
-                try:
-                    analysis_result = json.loads(analysis_json_str)
-                    # VALIDACIÓN ESTRICTA: verificar que TODOS los campos requeridos existan y no estén vacíos
-                    missing_fields = [f for f in REQUIRED_FIELDS if not analysis_result.get(f)]
-                    if missing_fields:
-                        print(f"  -> Warning: Analysis incompleto, faltan: {missing_fields}")
-                        analysis_result = None  # Considerar inválido
-                    else:
-                        is_valid_for_notification = True
-                except json.JSONDecodeError:
+            if schema_ok:
+                # Validado al guardarse: se envía tal cual, sin volver a parsearlo
+                notification_json = analysis_json_str
+            elif analysis_json_str:
+                analysis_result = stored_analyses[opp_id]  # Ya parseado arriba
+                if analysis_result is None:
                     print("  -> Warning: Stored analysis JSON is invalid.")
-            
-            # 2. If no valid analysis, try to generate it using AI (only if we have content)
-            if not is_valid_for_notification:
-                if content:
-                    # ML Pre-filter: Skip if low relevance probability
-                    if ml_model:
-                        config = {}  # Empty config, we're not using regex filter here
-                        if not pre_filter_content(content, config):
-                            print(f"  -> ML FILTER: Rejected (below {ML_FILTER_THRESHOLD} threshold)")
-                            cursor.execute("UPDATE opportunities SET status = 'ml_filtered' WHERE id = ?", (opp_id,))
-                            conn.commit()
-                            ml_filtered_count += 1
-                            continue
-                    
-                    # Check API call budget
-                    current_model = get_current_model()
-                    if current_model is None:
-                        print(f"\n⚠️ LÍMITE TOTAL ALCANZADO: {TOTAL_DAILY_LIMIT} llamadas.")
-                        print(f"   Deteniendo procesamiento.")
-                        break
-                    
-                    if api_call_counter % 20 == 0:
-                        print(f"\n📊 Usando modelo: {current_model} (Llamada {api_call_counter + 1}/{TOTAL_DAILY_LIMIT})")
-                    
-                    print("  -> Generating analysis with AI...")
-                    import time
-                    time.sleep(RATE_LIMIT_SLEEP)
-                    try:
-                        prompt = get_combined_analysis_prompt(content, source_type)
-                        analysis_result = analyze_text_with_ai(prompt, model_name=current_model)
-                        api_call_counter += 1
-                        
-                        if analysis_result:
-                            # Validar el resultado generado
-                            missing_fields = [f for f in REQUIRED_FIELDS if not analysis_result.get(f)]
-                            if missing_fields:
-                                print(f"  -> Warning: AI generó análisis incompleto, faltan: {missing_fields}")
-                                analysis_result = None
-                            else:
-                                # Guardar análisis válido
-                                trigger_event = "ManualProcess" 
-                                save_analysis(opp_id, trigger_event, 0.0, json.dumps(analysis_result))
-                                print("  -> Analysis generated and saved.")
-                                is_valid_for_notification = True
-                    except Exception as e:
-                        print(f"  -> Error during AI analysis: {e}")
                 else:
-                    # Sin contenido Y sin análisis válido = registro legacy, marcarlo para no procesarlo más
-                    print("  -> LEGACY RECORD: No content stored, no valid analysis. Marking as 'legacy_skip'.")
-                    cursor.execute("UPDATE opportunities SET status = 'legacy_skip' WHERE id = ?", (opp_id,))
-                    conn.commit()
-                    error_count += 1
-                    continue  # Saltar al siguiente sin intentar enviar
+                    # VALIDACIÓN ESTRICTA: verificar que TODOS los campos requeridos existan y no estén vacíos
+                    missing_fields = missing_required_fields(analysis_result)
+                    if not missing_fields:
+                        notification_json = analysis_json_str
+                    else:
+                        print(f"  -> Warning: Analysis incompleto, faltan: {missing_fields}")
             
-            # 3. Send Notification corresponding to the region (SOLO si es válido para notificación)
-            if is_valid_for_notification and analysis_result:
-                success = send_slack_notification(
-                    analysis_json_str=json.dumps(analysis_result),
-                    source_url=url,
-                    country=country
-                )
-                
-                if success:
-                    mark_as_notified(opp_id)
-                    print("  -> SUCCESS: Notification sent and marked as notified.")
+            # 2. Valid stored analysis: notify right away (SOLO si es válido para notificación)
+            if notification_json:
+                if notify(opp_id, url, country, notification_json, analysis=analysis_result):
                     processed_count += 1
-                    import time
-                    time.sleep(2) # Pausa de 2s para evitar Rate Limit de Slack (aprox 1 msg/s permitido)
                 else:
-                    print("  -> FAILED: Could not send Slack notification.")
                     error_count += 1
-            else:
+                continue
+            
+            # 3. No valid analysis: queue it for the AI (only if we have content)
+            if not content:
+                # Sin contenido Y sin análisis válido = registro legacy, marcarlo para no procesarlo más
+                print("  -> LEGACY RECORD: No content stored, no valid analysis. Marking as 'legacy_skip'.")
+                legacy_skip_ids.append(opp_id)
                 error_count += 1
-                print("  -> SKIPPING: Unable to obtain valid analysis.")
+                continue  # Saltar al siguiente sin intentar enviar
+            
+            # ML Pre-filter: Skip if low relevance probability (pre-computed in batch)
+            if ml_model:
+                if ml_verdicts.get(opp_id) is False:
+                    print(f"  -> ML FILTER: Rejected (below {ML_FILTER_THRESHOLD} threshold)")
+                    ml_filtered_ids.append(opp_id)
+                    ml_filtered_count += 1
+                    continue
+            
+            # Check API call budget
+            current_model = get_current_model()
+            if current_model is None:
+                if not budget_exhausted:
+                    print(f"\n⚠️ LÍMITE TOTAL ALCANZADO: {TOTAL_DAILY_LIMIT} llamadas.")
+                    print(f"   No se analizan más; se siguen notificando los ya analizados.")
+                    budget_exhausted = True
+                over_budget.append((opp_id, url, country, headline, content, source_type))
+                continue
+            
+            if api_call_counter % 20 == 0:
+                print(f"\n📊 Usando modelo: {current_model} (Llamada {api_call_counter + 1}/{TOTAL_DAILY_LIMIT})")
+            
+            print("  -> Queued for AI analysis.")
+            to_analyze.append((opp_id, url, country, headline, content, source_type, current_model))
+            api_call_counter += 1
+        
+        # 4. AI analysis on a small thread pool (each call waits for its model's rate-limit slot);
+        #    Slack sends and DB writes stay on this thread as results come in
+        if to_analyze:
+            print(f"\nAnalyzing {len(to_analyze)} opportunities with AI ({ANALYSIS_WORKERS} workers)...")
+            with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as executor:
+                futures = {
+                    executor.submit(analyze_opportunity, content, source_type, model): (opp_id, url, country, headline)
+                    for opp_id, url, country, headline, content, source_type, model in to_analyze
+                }
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        opp_id, url, country, headline = futures.pop(future)
+                        print(f"\nAnalysis finished for Opportunity ID {opp_id}: {headline[:50]}...")
+                        try:
+                            analysis_result = future.result()
+                        except Exception as e:
+                            print(f"  -> Error during AI analysis: {e}")
+                            analysis_result = None
+                        
+                        if analysis_result is None:
+                            # Failed call: refund its slot (same rule as agent.analyze_pending_batch)
+                            # and give it to the next row that was left out by the budget
+                            api_call_counter -= 1
+                            if over_budget:
+                                next_id, next_url, next_country, next_headline, next_content, next_type = over_budget.pop(0)
+                                print(f"  -> Slot freed: queued Opportunity ID {next_id} for AI analysis.")
+                                futures[executor.submit(analyze_opportunity, next_content, next_type, get_current_model())] = (
+                                    next_id, next_url, next_country, next_headline)
+                                api_call_counter += 1
+                        
+                        # Validar el resultado generado
+                        if analysis_result and all(analysis_result.get(f) for f in REQUIRED_FIELDS):
+                            print("  -> Analysis generated.")
+                            new_analysis_json = json_dumps(analysis_result)
+                            # Se guarda junto con el cambio de estado tras notificar (un solo UPDATE)
+                            if notify(opp_id, url, country, new_analysis_json, new_analysis_json, analysis=analysis_result):
+                                processed_count += 1
+                            else:
+                                error_count += 1
+                        else:
+                            if analysis_result:
+                                missing_fields = [f for f in REQUIRED_FIELDS if not analysis_result.get(f)]
+                                print(f"  -> Warning: AI generó análisis incompleto, faltan: {missing_fields}")
+                            error_count += 1
+                            print("  -> SKIPPING: Unable to obtain valid analysis.")
+
+        flush_status_updates()
 
         print(f"\nProcessing complete.")
         print(f"  -> Successfully processed: {processed_count}")
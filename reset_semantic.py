@@ -3,19 +3,21 @@ Reset semantic filter training data.
 Run this to clear accumulated negatives and start fresh.
 """
 import os
-import pickle
 
-MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'semantic_filter.pkl')
+from semantic_filter import STORAGE_FILES
 
 def reset_semantic_filter():
     """Reset the semantic filter training data."""
     print("Resetting semantic filter...")
     
-    if os.path.exists(MODEL_PATH):
-        os.remove(MODEL_PATH)
-        print(f"  -> Deleted {MODEL_PATH}")
-    else:
-        print(f"  -> No filter file found at {MODEL_PATH}")
+    deleted = 0
+    for path in STORAGE_FILES:  # JSON metadata, .npy embeddings, append logs and any legacy .pkl
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"  -> Deleted {path}")
+            deleted += 1
+    if not deleted:
+        print("  -> No filter files found")
     
     print("Done! Run bootstrap_semantic.py to repopulate from database.")
 
@@ -1,12 +1,14 @@
 import sqlite3
+from database import get_connection
+
 try:
-    conn = sqlite3.connect('opportunities.db')
+    # Shared connection: same DB_NAME as the agent (not relative to the cwd), and it ensures
+    # idx_opp_status_notified, whose (status, ...) prefix serves this WHERE status IN (...)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE opportunities SET status = 'detected' WHERE status IN ('relevant', 'error_analysis')")
     updated = cursor.rowcount
     conn.commit()
     print(f"Successfully updated {updated} records to 'detected' status.")
-except Exception as e:
+except sqlite3.Error as e:
     print(f"Error: {e}")
-finally:
-    if conn: conn.close()
@@ -1,10 +1,27 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import os # <-- ¡Importante! Para leer las variables de entorno
 
 # --- FUNCIÓN PARA SCRAPING DE GLASSDOOR USANDO SCRAPINGBEE ---
 
+# Sesión compartida: las llamadas sucesivas (una por título/ubicación) reutilizan la conexión TLS
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    # Reintentos solo ante fallos de conexión o errores transitorios del gateway
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+))
+
+def _is_job_listing_class(css_class):
+    # Las dos clases de tarjeta de oferta conocidas (pueden necesitar ajuste)
+    return bool(css_class) and ('react-job-listing' in css_class or 'JobCard' in css_class)
+
+# lxml solo construye los <li> de ofertas (y su contenido); el resto de la página se descarta al parsear
+JOB_LISTING_STRAINER = SoupStrainer('li', attrs={'class': _is_job_listing_class})
+
 def scrape_glassdoor_jobs(keywords, location="Mexico"):
     """
     Realiza scraping de ofertas de empleo en Glassdoor utilizando ScrapingBee
@@ -27,18 +44,21 @@ def scrape_glassdoor_jobs(keywords, location="Mexico"):
     }
 
     try:
-        response = requests.get(api_endpoint, params=params, timeout=120) # Aumentamos el timeout
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'lxml')
-        job_listings = soup.select('li.react-job-listing') # Esta clase puede necesitar ajuste
+        # stream=True: el cuerpo se lee directamente del socket como bytes (sin la copia
+        # decodificada de response.text ni la detección de charset sobre varios MB de HTML);
+        # lxml toma la codificación del propio documento
+        with _SESSION.get(api_endpoint, params=params, timeout=120, stream=True) as response: # Aumentamos el timeout
+            response.raise_for_status()
+            response.raw.decode_content = True  # Descomprimir gzip/deflate al leer
+            soup = BeautifulSoup(response.raw, 'lxml', parse_only=JOB_LISTING_STRAINER)
+        job_listings = soup.find_all('li')
+        # Si hay tarjetas 'react-job-listing' se usan esas; si no, las de clase *JobCard*
+        react_listings = [li for li in job_listings if 'react-job-listing' in (li.get('class') or [])]
+        job_listings = react_listings or job_listings
 
         if not job_listings:
-            # Intentamos con otra posible clase si la primera falla
-            job_listings = soup.select('li[class*="JobCard"]')
-            if not job_listings:
-                 print("  -> Petición exitosa, pero no se encontraron ofertas.")
-                 return []
+            print("  -> Petición exitosa, pero no se encontraron ofertas.")
+            return []
 
         extracted_jobs = []
         for job in job_listings:
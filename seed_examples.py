@@ -1,10 +1,14 @@
 import sqlite3
 import os
 import sys
+import time
 
 # DATABASE PATH
 DB_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opportunities.db')
 
+# Pasted examples are written in batches of this size (one executemany + commit per batch)
+SEED_FLUSH_EVERY = 10
+
 def seed_examples():
     """
     Allow user to manually enter positive examples to train the semantic filter.
@@ -24,33 +28,52 @@ def seed_examples():
     print("Type 'EXIT' to finish.\n")
 
     count = 0
-    while True:
-        text = input(f"\nExample #{count + 1} (or EXIT): ").strip()
-        
-        if text.upper() == 'EXIT':
-            break
-        
-        if not text:
-            continue
-        
-        # Insert as a 'relevant' opportunity
-        # We use a unique source_url to identify it as manual seed
-        import time
+    pending = []  # (source_url, content, headline) rows not yet written
+
+    def flush():
+        """Writes the pending examples in one transaction. Returns how many were new."""
+        nonlocal count
+        if not pending:
+            return 0
         try:
-            timestamp = int(time.time())
-            cursor.execute("""
-                INSERT INTO opportunities (source_url, content, headline, source_type, status, feedback_rationale)
+            before = conn.total_changes
+            cursor.executemany("""
+                INSERT OR IGNORE INTO opportunities (source_url, content, headline, source_type, status, feedback_rationale)
                 VALUES (?, ?, ?, 'manual_seed', 'relevant', 'Manual Seed')
-            """, (f"manual_{timestamp}_{count}", text, text[:50]))
-            
+            """, pending)
             conn.commit()
-            print(f"  -> Saved! The AI will now look for things like: '{text[:40]}...'")
-            count += 1
-            
-        except sqlite3.IntegrityError:
-             print("  -> Skipped (Duplicate?)")
+            saved = conn.total_changes - before
+            if saved < len(pending):
+                print(f"  -> Skipped {len(pending) - saved} (Duplicate?)")
+            count += saved
+            return saved
         except Exception as e:
+            conn.rollback()
             print(f"  -> Error: {e}")
+            return 0
+        finally:
+            pending.clear()
+
+    try:
+        while True:
+            text = input(f"\nExample #{count + len(pending) + 1} (or EXIT): ").strip()
+            
+            if text.upper() == 'EXIT':
+                break
+            
+            if not text:
+                continue
+            
+            # Insert as a 'relevant' opportunity
+            # We use a unique source_url to identify it as manual seed (ns: no collisions when pasting)
+            pending.append((f"manual_{time.time_ns()}_{count + len(pending)}", text, text[:50]))
+            print(f"  -> Added! The AI will now look for things like: '{text[:40]}...'")
+            if len(pending) >= SEED_FLUSH_EVERY:
+                flush()
+    except (EOFError, KeyboardInterrupt):
+        print()  # End of pasted input / Ctrl+C: keep what was entered
+    finally:
+        flush()
 
     conn.close()
     
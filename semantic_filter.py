@@ -4,25 +4,158 @@ Replaces Naive Bayes with embedding-based similarity for smarter filtering.
 """
 import os
 import json
+import base64
 import pickle
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
 import numpy as np
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 # Lazy loading to avoid slow startup
 _model = None
+_model_variant = ''  # '' for the default PyTorch weights, else the ONNX file / bf16 mode in use (part of the cache key)
 _embeddings_cache = None
+# In-process LRU in front of semantic_cache.db: content hash -> embedding
+_encode_cache = OrderedDict()
+ENCODE_CACHE_SIZE = 4096
 
-MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'semantic_filter.pkl')
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(DATA_DIR, 'semantic_filter.pkl')  # Legacy pickle format, migrated on first load
+META_PATH = os.path.join(DATA_DIR, 'semantic_filter_meta.json')  # Example texts (and reasons for negatives)
+EMBEDDING_PATHS = {
+    'positive': os.path.join(DATA_DIR, 'semantic_filter_positive.npy'),
+    'negative': os.path.join(DATA_DIR, 'semantic_filter_negative.npy'),
+}
+# Append-only logs for single-example adds; folded into the .npy/.json every COMPACT_EVERY entries
+LOG_PATHS = {
+    'positive': os.path.join(DATA_DIR, 'semantic_filter_positive.log.jsonl'),
+    'negative': os.path.join(DATA_DIR, 'semantic_filter_negative.log.jsonl'),
+}
+COMPACT_EVERY = 64
+STORAGE_FILES = (META_PATH, *EMBEDDING_PATHS.values(), *LOG_PATHS.values(), MODEL_PATH)
+MAX_HISTORY = 2000  # FIFO cap per label (Concept Drift + Performance)
+STORAGE_DTYPE = np.float16  # On-disk embedding precision; older float32 files still load as-is
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, 'semantic_cache.db')  # content hash -> embedding
 SENTENCE_TRANSFORMER_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'  # Supports 50+ languages including Spanish
+# Prequantized int8 export published with the model; used when sentence-transformers[onnx] is installed
+ONNX_QUANTIZED_FILE = 'onnx/model_qint8_avx512_vnni.onnx'
+ONNX_LOCAL_DIR = os.path.join(DATA_DIR, 'semantic_model_onnx')  # Local int8 export if the hub has none
+# Tokens encoded per text; longer articles are truncated (attention cost grows with length^2).
+# Same value the model ships with, pinned so both backends and the embedding cache agree.
+MAX_SEQ_LENGTH = 128
+# CPU PyTorch path: bfloat16 via intel-extension-for-pytorch when installed and the CPU has native bf16
+IPEX_VARIANT = 'ipex-bf16'
+# Opt-in static-embedding backend (SEMANTIC_BACKEND=model2vec): token lookup + mean pooling,
+# far faster than the transformer on CPU. Its vectors live in a different space, so the stored
+# examples must be rebuilt (reset_semantic.py + bootstrap_semantic.py) after switching.
+SEMANTIC_BACKEND = os.environ.get('SEMANTIC_BACKEND', '').strip().lower()
+MODEL2VEC_MODEL = 'minishlab/potion-multilingual-128M'
+
+def _load_model2vec_model():
+    """Model2Vec StaticModel (same encode(texts) -> ndarray interface), or None if unavailable."""
+    try:
+        from model2vec import StaticModel
+    except ImportError:
+        print("  -> AVISO: SEMANTIC_BACKEND=model2vec pero model2vec no está instalado; usando sentence-transformers.")
+        return None
+    try:
+        return StaticModel.from_pretrained(MODEL2VEC_MODEL)
+    except Exception as e:
+        print(f"  -> AVISO: no se pudo cargar {MODEL2VEC_MODEL} ({e}); usando sentence-transformers.")
+        return None
+
+def _configure_cpu_threads():
+    """Use every core this process may run on for intra-op parallelism (one inter-op thread)."""
+    n_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    # Read by OpenMP/MKL (and ONNX Runtime) when they initialise; explicit user settings win
+    os.environ.setdefault('OMP_NUM_THREADS', str(n_threads))
+    os.environ.setdefault('MKL_NUM_THREADS', str(n_threads))
+    try:
+        import torch
+        torch.set_num_threads(int(os.environ['OMP_NUM_THREADS']))
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError, ValueError):
+        pass  # No torch, or inter-op pool already started
+
+def _cuda_available() -> bool:
+    """True if PyTorch sees a CUDA GPU."""
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+def _ipex_bf16_optimize(model) -> bool:
+    """Optimize the transformer in place with IPEX for bf16 CPU inference. False if unavailable."""
+    try:
+        import torch
+        import intel_extension_for_pytorch as ipex
+        if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return False  # No AVX512-bf16/AMX: emulated bf16 would be slower than fp32
+        transformer = model[0]
+        transformer.auto_model = ipex.optimize(transformer.auto_model.eval(), dtype=torch.bfloat16)
+        return True
+    except Exception:
+        return False
+
+def _encode_context():
+    """bf16 autocast around encode() when the IPEX-optimized model is in use."""
+    if _model_variant == IPEX_VARIANT:
+        import torch
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+def _load_onnx_model(SentenceTransformer):
+    """Int8 ONNX Runtime backend (faster CPU encode, ~half the RAM), or None if unavailable."""
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return SentenceTransformer(SENTENCE_TRANSFORMER_MODEL, backend="onnx",
+                                   model_kwargs={"file_name": ONNX_QUANTIZED_FILE})
+    except Exception:
+        pass  # No prequantized file published for this model: export one locally
+    try:
+        if not os.path.exists(os.path.join(ONNX_LOCAL_DIR, ONNX_QUANTIZED_FILE)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            print(f"  -> Exportando {SENTENCE_TRANSFORMER_MODEL} a ONNX int8 (solo la primera vez)...")
+            onnx_model = SentenceTransformer(SENTENCE_TRANSFORMER_MODEL, backend="onnx")
+            onnx_model.save(ONNX_LOCAL_DIR)
+            export_dynamic_quantized_onnx_model(onnx_model, "avx512_vnni", ONNX_LOCAL_DIR)
+        return SentenceTransformer(ONNX_LOCAL_DIR, backend="onnx",
+                                   model_kwargs={"file_name": ONNX_QUANTIZED_FILE})
+    except Exception as e:
+        print(f"  -> AVISO: backend ONNX no disponible ({e}); usando PyTorch.")
+        return None
 
 def get_model():
-    """Lazy load the sentence transformer model."""
-    global _model
+    """Lazy load the sentence transformer model (PyTorch on a CUDA GPU, else ONNX int8 if available, else PyTorch on CPU)."""
+    global _model, _model_variant
+    if _model is None and SEMANTIC_BACKEND == 'model2vec':
+        _model = _load_model2vec_model()
+        if _model is not None:
+            _model_variant = f"model2vec:{MODEL2VEC_MODEL}"
+            print(f"  -> Modelo semántico cargado: {MODEL2VEC_MODEL} (model2vec)")
     if _model is None:
         try:
+            _configure_cpu_threads()  # Env vars must be set before torch is first imported
             from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer(SENTENCE_TRANSFORMER_MODEL)
-            print(f"  -> Modelo semántico cargado: {SENTENCE_TRANSFORMER_MODEL}")
+            # The int8 ONNX file targets CPU; with a GPU the FP32 model on CUDA is much faster
+            use_cuda = _cuda_available()
+            _model = None if use_cuda else _load_onnx_model(SentenceTransformer)
+            if _model is not None:
+                _model_variant = ONNX_QUANTIZED_FILE
+            else:
+                _model = SentenceTransformer(SENTENCE_TRANSFORMER_MODEL, device='cuda' if use_cuda else 'cpu')
+                if not use_cuda and _ipex_bf16_optimize(_model):
+                    _model_variant = IPEX_VARIANT
+            _model.max_seq_length = MAX_SEQ_LENGTH
+            print(f"  -> Modelo semántico cargado: {SENTENCE_TRANSFORMER_MODEL} {_model_variant}".rstrip())
         except ImportError:
             print("  -> AVISO: sentence-transformers no instalado. Filtro semántico desactivado.")
             return None
@@ -31,37 +164,291 @@ def get_model():
             return None
     return _model
 
+def warm_up_async() -> threading.Thread:
+    """
+    Load the sentence transformer and the stored examples on a background thread,
+    so the load overlaps the caller's network I/O. join() the returned thread
+    before the first encode/score call.
+    """
+    def warm_up():
+        if get_model() is not None:
+            load_training_data()
+    thread = threading.Thread(target=warm_up, name="semantic-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def _content_hash(text: str) -> str:
+    """Cache key: model name (+ ONNX variant) + text, so switching models never returns stale vectors."""
+    model_id = f"{SENTENCE_TRANSFORMER_MODEL}\0{_model_variant}" if _model_variant else SENTENCE_TRANSFORMER_MODEL
+    return hashlib.blake2b(f"{model_id}\0{text}".encode('utf-8'), digest_size=16).hexdigest()
+
+_cache_local = threading.local()  # Per-thread connection to semantic_cache.db
+
+def _cache_conn() -> sqlite3.Connection:
+    """
+    This thread's connection to the embedding cache, opened (and the table created)
+    on first use and reused afterwards; reopened if EMBEDDING_CACHE_PATH changes.
+    """
+    cached = getattr(_cache_local, 'conn', None)
+    if cached is not None and cached[0] == EMBEDDING_CACHE_PATH:
+        return cached[1]
+    _close_cache_conn()
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache (hash TEXT PRIMARY KEY, emb BLOB NOT NULL)")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    _cache_local.conn = (EMBEDDING_CACHE_PATH, conn)
+    return conn
+
+def _close_cache_conn():
+    """Close and forget this thread's cache connection (after an error, so the next call reconnects)."""
+    cached = getattr(_cache_local, 'conn', None)
+    _cache_local.conn = None
+    if cached is not None:
+        cached[1].close()
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """
+    Encode texts with the sentence transformer, reusing cached embeddings.
+    Hashes are looked up first in an in-process LRU (_encode_cache), then in
+    semantic_cache.db; only the misses are encoded, in one batched call, and
+    stored in both, so retried/pending articles and examples added after scoring
+    are not re-encoded. Returns a float32 (n, dim) matrix.
+    """
+    model = get_model()
+    if model is None or not texts:
+        return None
+    
+    keys = [_content_hash(text) for text in texts]
+    cached = {}
+    for key in dict.fromkeys(keys):
+        emb = _encode_cache.get(key)
+        if emb is not None:
+            _encode_cache.move_to_end(key)
+            cached[key] = emb
+    unique_keys = [key for key in dict.fromkeys(keys) if key not in cached]
+    if not unique_keys:
+        return np.stack([cached[key] for key in keys])
+    
+    try:
+        conn = _cache_conn()
+        for start in range(0, len(unique_keys), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = unique_keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT hash, emb FROM embedding_cache WHERE hash IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            cached.update((h, np.frombuffer(emb, dtype=np.float32)) for h, emb in rows)
+    except sqlite3.Error as e:
+        print(f"  -> AVISO: caché de embeddings no disponible ({e})")
+        _close_cache_conn()
+        conn = None
+    
+    missing = list({key: text for key, text in zip(keys, texts) if key not in cached}.items())
+    if missing:
+        # No length-bucketing here: SentenceTransformer.encode already sorts its input by
+        # length before batching (and restores the original order), so batches pad minimally
+        with _encode_context():
+            fresh = np.asarray(model.encode([text for _, text in missing], batch_size=64), dtype=np.float32)
+        cached.update((key, emb) for (key, _), emb in zip(missing, fresh))
+        if conn is not None:
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embedding_cache (hash, emb) VALUES (?, ?)",
+                    [(key, emb.tobytes()) for (key, _), emb in zip(missing, fresh)]
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"  -> AVISO: no se pudo guardar en la caché de embeddings ({e})")
+                _close_cache_conn()
+    
+    for key in unique_keys:
+        _encode_cache[key] = cached[key]
+    while len(_encode_cache) > ENCODE_CACHE_SIZE:
+        _encode_cache.popitem(last=False)
+    
+    return np.stack([cached[key] for key in keys])
+
+def encode_text(text: str) -> np.ndarray:
+    """Single-text version of encode_texts."""
+    embeddings = encode_texts([text])
+    return None if embeddings is None else embeddings[0]
+
+def _empty_training_data() -> dict:
+    # Parallel arrays per label: row i of '<label>_embeddings' belongs to '<label>_texts'[i]
+    return {
+        'positive_texts': [],  # Texts of relevant articles
+        'negative_texts': [],  # Texts of rejected articles
+        'negative_reasons': [],  # AI rejection reason for each negative text
+        'positive_embeddings': None,  # (N, dim) L2-normalized matrix of positive embeddings
+        'negative_embeddings': None,  # (N, dim) L2-normalized matrix of negative embeddings
+    }
+
+def _from_legacy(data: dict) -> dict:
+    """Convert the old list-of-tuples layout (semantic_filter.pkl) into parallel arrays."""
+    converted = _empty_training_data()
+    positive = data.get('positive', [])
+    negative = data.get('negative', [])
+    if positive:
+        converted['positive_texts'] = [text for text, _ in positive]
+        converted['positive_embeddings'] = np.array([emb for _, emb in positive], dtype=np.float32)
+    if negative:
+        converted['negative_texts'] = [text for text, _, _ in negative]
+        converted['negative_reasons'] = [reason for _, reason, _ in negative]
+        converted['negative_embeddings'] = np.array([emb for _, _, emb in negative], dtype=np.float32)
+    return converted
+
+def _append_examples(data: dict, label: str, texts: List[str], embeddings: np.ndarray,
+                     reasons: Optional[List[str]] = None):
+    """
+    Append examples to a label's parallel arrays (new rows L2-normalized and
+    stacked under the matrix) and keep only the last MAX_HISTORY (FIFO rotation).
+    """
+    new_rows = _l2_normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1))
+    matrix = data[f'{label}_embeddings']
+    if matrix is not None and len(matrix):
+        new_rows = np.vstack([np.asarray(matrix, dtype=np.float32), new_rows])
+    data[f'{label}_embeddings'] = new_rows[-MAX_HISTORY:]
+    data[f'{label}_texts'] = (data[f'{label}_texts'] + list(texts))[-MAX_HISTORY:]
+    if label == 'negative':
+        data['negative_reasons'] = (data['negative_reasons'] + list(reasons))[-MAX_HISTORY:]
+
+def _load_embedding_matrix(label: str, expected_rows: int) -> Optional[np.ndarray]:
+    """Memory-map a stored embedding matrix (read-only, zero-copy) and check it matches the metadata."""
+    if expected_rows == 0:
+        return None
+    matrix = np.load(EMBEDDING_PATHS[label], mmap_mode='r')
+    if len(matrix) != expected_rows:
+        raise ValueError(f"{EMBEDDING_PATHS[label]} tiene {len(matrix)} filas, se esperaban {expected_rows}")
+    return matrix
+
+def _atomic_write(path: str, write):
+    """Write via a temp file + os.replace so readers never see a half-written file."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _append_to_log(data: dict, label: str, text: str, embedding: np.ndarray, reason: Optional[str] = None):
+    """
+    Persist one new example by appending a JSON line (text, reason, float16
+    embedding) to the label's log instead of rewriting the whole store.
+    Every COMPACT_EVERY logged entries the store is compacted with save_training_data.
+    """
+    record = {'text': text, 'emb': base64.b64encode(np.asarray(embedding, dtype=STORAGE_DTYPE).tobytes()).decode('ascii')}
+    if label == 'negative':
+        record['reason'] = reason
+    try:
+        with open(LOG_PATHS[label], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"  -> AVISO: no se pudo escribir el log del filtro semántico ({e}); guardando completo.")
+        save_training_data(data)
+        return
+    data['_logged'] = data.get('_logged', 0) + 1
+    if data['_logged'] >= COMPACT_EVERY:
+        save_training_data(data)
+
+def _replay_log(data: dict, label: str) -> int:
+    """Append the examples logged since the last compaction (FIFO cap applied). Returns how many."""
+    path = LOG_PATHS[label]
+    if not os.path.exists(path):
+        return 0
+    texts, reasons, embeddings = [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn last line if the process died mid-write
+            texts.append(record['text'])
+            reasons.append(record.get('reason', ''))
+            embeddings.append(np.frombuffer(base64.b64decode(record['emb']), dtype=STORAGE_DTYPE))
+    if texts:
+        _append_examples(data, label, texts, np.stack(embeddings), reasons)
+    return len(texts)
+
+def _with_logged_examples(data: dict) -> dict:
+    """Replay both logs onto freshly loaded data."""
+    data['_logged'] = sum(_replay_log(data, label) for label in ('positive', 'negative'))
+    return data
+
 def load_training_data() -> dict:
-    """Load saved embeddings and examples from disk."""
+    """Load saved embeddings and examples from disk (consolidated files + append-only logs)."""
     global _embeddings_cache
     if _embeddings_cache is not None:
         return _embeddings_cache
     
-    if os.path.exists(MODEL_PATH):
+    if os.path.exists(META_PATH):
+        try:
+            with open(META_PATH, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            data = _empty_training_data()
+            data['positive_embeddings'] = _load_embedding_matrix('positive', len(meta['positive']))
+            data['negative_embeddings'] = _load_embedding_matrix('negative', len(meta['negative']))
+            data['positive_texts'] = list(meta['positive'])
+            data['negative_texts'] = [text for text, _ in meta['negative']]
+            data['negative_reasons'] = [reason for _, reason in meta['negative']]
+            _embeddings_cache = _with_logged_examples(data)
+            if any(_has_unnormalized_rows(data[f'{label}_embeddings']) for label in ('positive', 'negative')):
+                print("  -> Normalizando embeddings guardados (L2) y re-guardando...")
+                save_training_data(data)
+            print(f"  -> Datos de filtro semántico cargados ({len(data['positive_texts'])} positivos, {len(data['negative_texts'])} negativos)")
+            return _embeddings_cache
+        except Exception as e:
+            print(f"  -> Error cargando filtro semántico: {e}")
+    elif os.path.exists(MODEL_PATH):
         try:
             with open(MODEL_PATH, 'rb') as f:
-                _embeddings_cache = pickle.load(f)
-                print(f"  -> Datos de filtro semántico cargados ({len(_embeddings_cache.get('positive', []))} positivos, {len(_embeddings_cache.get('negative', []))} negativos)")
-                return _embeddings_cache
+                data = _with_logged_examples(_from_legacy(pickle.load(f)))
+            print(f"  -> Migrando filtro semántico de {os.path.basename(MODEL_PATH)} a .npy + JSON...")
+            save_training_data(data)
+            print(f"  -> Datos de filtro semántico cargados ({len(data['positive_texts'])} positivos, {len(data['negative_texts'])} negativos)")
+            return _embeddings_cache
         except Exception as e:
             print(f"  -> Error cargando filtro semántico: {e}")
     
-    # Return empty structure if no saved data
-    _embeddings_cache = {
-        'positive': [],  # List of (text, embedding) tuples for relevant articles
-        'negative': [],  # List of (text, reason, embedding) tuples for rejected articles
-        'positive_embeddings': None,  # Numpy array of positive embeddings
-        'negative_embeddings': None,  # Numpy array of negative embeddings
-    }
+    # Return empty structure if no saved data (plus anything logged before the first compaction)
+    _embeddings_cache = _with_logged_examples(_empty_training_data())
     return _embeddings_cache
 
 def save_training_data(data: dict):
-    """Save embeddings and examples to disk."""
+    """
+    Save examples to disk: texts/reasons in a JSON sidecar, embeddings as
+    float16 .npy matrices (half the bytes of float32) that load_training_data
+    memory-maps on startup. In memory and for scoring they stay float32.
+    Rows are stored L2-normalized, so cosine similarity is a plain dot product.
+    This is the compaction step: the append-only logs are removed afterwards.
+    """
     global _embeddings_cache
     _embeddings_cache = data
     try:
-        with open(MODEL_PATH, 'wb') as f:
-            pickle.dump(data, f)
+        for label in ('positive', 'negative'):
+            matrix = data[f'{label}_embeddings']
+            if matrix is None or len(matrix) == 0:
+                data[f'{label}_embeddings'] = None
+                if os.path.exists(EMBEDDING_PATHS[label]):
+                    os.remove(EMBEDDING_PATHS[label])
+                continue
+            # Copy into RAM: this drops the read-only mapping of the old file
+            # so it can be replaced (required on Windows)
+            matrix = _l2_normalize(np.array(matrix, dtype=np.float32))
+            data[f'{label}_embeddings'] = matrix
+            _atomic_write(EMBEDDING_PATHS[label], lambda f: np.save(f, matrix.astype(STORAGE_DTYPE)))
+        
+        # Metadata last: it is what load_training_data checks row counts against
+        meta = {
+            'positive': data['positive_texts'],
+            'negative': [[text, reason] for text, reason in zip(data['negative_texts'], data['negative_reasons'])],
+        }
+        _atomic_write(META_PATH, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+        
+        # Everything logged is now in the consolidated files
+        for path in LOG_PATHS.values():
+            if os.path.exists(path):
+                os.remove(path)
+        data['_logged'] = 0
     except Exception as e:
         print(f"  -> Error guardando filtro semántico: {e}")
 
@@ -71,22 +458,17 @@ def add_positive_example(text: str):
     if model is None:
         return
     
-    # Limit history to prevent infinite growth (Concept Drift + Performance)
-    MAX_HISTORY = 2000
-    
     data = load_training_data()
-    embedding = model.encode(text)
-    data['positive'].append((text, embedding))
-    
+    embedding = encode_text(text)
+    mismatch = _store_mismatch(data, embedding.shape[-1])
+    if mismatch:
+        print(f"  -> AVISO: {mismatch}")
+        return
     # FIFO Rotation: Keep only the last MAX_HISTORY examples
-    if len(data['positive']) > MAX_HISTORY:
-        data['positive'] = data['positive'][-MAX_HISTORY:]
-    
-    # Rebuild embeddings matrix
-    if data['positive']:
-        data['positive_embeddings'] = np.array([e[1] for e in data['positive']])
+    _append_examples(data, 'positive', [text], embedding)
     
-    save_training_data(data)
+    # Log the (normalized) example; the in-memory matrix is already updated for scoring
+    _append_to_log(data, 'positive', text, data['positive_embeddings'][-1])
     print(f"  -> Añadido ejemplo positivo para entrenamiento semántico")
 
 def add_negative_example(text: str, reason: str):
@@ -97,76 +479,142 @@ def add_negative_example(text: str, reason: str):
     
     data = load_training_data()
     
-    # Cap negatives at 2000 (User Request) to optimize storage
-    MAX_NEGATIVE_HISTORY = 2000
-    
     # Only embed the text to keep semantic space clean.
-    embedding = model.encode(text)
-    data['negative'].append((text, reason, embedding))
-    
-    # FIFO Rotation
-    if len(data['negative']) > MAX_NEGATIVE_HISTORY:
-        data['negative'] = data['negative'][-MAX_NEGATIVE_HISTORY:]
-        print(f"  -> Cap de negativos ({MAX_NEGATIVE_HISTORY}) alcanzado, rotando antiguos.")
-    
-    # Rebuild embeddings matrix
-    if data['negative']:
-        data['negative_embeddings'] = np.array([e[2] for e in data['negative']])
+    embedding = encode_text(text)
+    mismatch = _store_mismatch(data, embedding.shape[-1])
+    if mismatch:
+        print(f"  -> AVISO: {mismatch}")
+        return
+    # FIFO Rotation: cap negatives at MAX_HISTORY (User Request) to optimize storage
+    if len(data['negative_texts']) >= MAX_HISTORY:
+        print(f"  -> Cap de negativos ({MAX_HISTORY}) alcanzado, rotando antiguos.")
+    _append_examples(data, 'negative', [text], embedding, [reason])
     
-    save_training_data(data)
+    # Log the (normalized) example; the in-memory matrix is already updated for scoring
+    _append_to_log(data, 'negative', text, data['negative_embeddings'][-1], reason)
     print(f"  -> Añadido ejemplo negativo para entrenamiento semántico")
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """Calculate cosine similarity between two vectors."""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-def predict_relevance(text: str, threshold: float = 0.65) -> Tuple[bool, float, str]:
+def add_examples_batch(texts: List[str], label: str, reasons: Optional[List[str]] = None) -> int:
     """
-    Predict if an article is relevant using semantic similarity.
-    
-    Returns:
-        Tuple of (is_relevant, confidence, explanation)
+    Add many examples of one polarity ('positive' or 'negative') at once.
+    Encodes all texts in a single batched model.encode call and saves to disk
+    once, instead of one encode + one pickle write per example.
+    Returns the number of examples added.
     """
+    if label not in ('positive', 'negative'):
+        raise ValueError(f"label must be 'positive' or 'negative', got {label!r}")
+    
     model = get_model()
-    if model is None:
-        # Fallback: pass everything if model not available
-        return True, 0.5, "Modelo semántico no disponible"
+    if model is None or not texts:
+        return 0
     
     data = load_training_data()
+    embeddings = encode_texts(texts)
+    mismatch = _store_mismatch(data, embeddings.shape[-1])
+    if mismatch:
+        print(f"  -> AVISO: {mismatch}")
+        return 0
+    
+    if label == 'negative' and reasons is None:
+        reasons = ["Sin razón"] * len(texts)
+    # FIFO Rotation included
+    _append_examples(data, label, texts, embeddings, reasons)
     
+    save_training_data(data)
+    print(f"  -> Añadidos {len(texts)} ejemplos {'positivos' if label == 'positive' else 'negativos'} para entrenamiento semántico")
+    return len(texts)
+
+def _untrained_verdict(data: dict) -> Optional[Tuple[bool, float, str]]:
+    """Return a pass-through verdict while there is not enough training data, else None."""
     # If no training data yet, pass everything
-    if not data['positive'] and not data['negative']:
+    if not data['positive_texts'] and not data['negative_texts']:
         return True, 0.5, "Sin datos de entrenamiento"
     
     # IMPORTANT: Require minimum positive examples before rejecting
     # With too few positives, the filter is biased towards rejection
     MIN_POSITIVE_COUNT = 5
-    if len(data['positive']) < MIN_POSITIVE_COUNT:
-        return True, 0.5, f"Insuficientes ejemplos positivos ({len(data['positive'])}/{MIN_POSITIVE_COUNT})"
-    
-    # Get embedding for input text
-    text_embedding = model.encode(text)
-    
-    # Calculate average similarity to positive examples
-    pos_similarity = 0.0
-    if data['positive_embeddings'] is not None and len(data['positive_embeddings']) > 0:
-        similarities = [cosine_similarity(text_embedding, pe) for pe in data['positive_embeddings']]
-        pos_similarity = max(similarities) if similarities else 0.0
-    
-    # Calculate average similarity to negative examples
-    neg_similarity = 0.0
-    most_similar_negative_reason = ""
-    if data['negative_embeddings'] is not None and len(data['negative_embeddings']) > 0:
-        negative_similarities = []
-        for i, ne in enumerate(data['negative_embeddings']):
-            sim = cosine_similarity(text_embedding, ne)
-            negative_similarities.append((sim, data['negative'][i][1]))  # (similarity, reason)
-        
-        if negative_similarities:
-            most_similar = max(negative_similarities, key=lambda x: x[0])
-            neg_similarity = most_similar[0]
-            most_similar_negative_reason = most_similar[1]
+    if len(data['positive_texts']) < MIN_POSITIVE_COUNT:
+        return True, 0.5, f"Insuficientes ejemplos positivos ({len(data['positive_texts'])}/{MIN_POSITIVE_COUNT})"
     
+    return None
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization (zero rows stay zero)."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def _store_mismatch(data: dict, dim: int) -> Optional[str]:
+    """Message if the stored examples were embedded by a model with another output size, else None."""
+    for label in ('positive', 'negative'):
+        matrix = data.get(f'{label}_embeddings')
+        if matrix is not None and len(matrix) and matrix.shape[1] != dim:
+            return (f"Ejemplos guardados con otro modelo ({matrix.shape[1]} dims, modelo actual {dim}): "
+                    "ejecuta reset_semantic.py + bootstrap_semantic.py")
+    return None
+
+def _has_unnormalized_rows(matrix: Optional[np.ndarray]) -> bool:
+    """True if a stored matrix predates L2-normalized storage (tolerance covers float16 rounding)."""
+    if matrix is None or len(matrix) == 0:
+        return False
+    norms = np.linalg.norm(np.asarray(matrix, dtype=np.float32), axis=1)
+    return bool(np.any((np.abs(norms - 1.0) > 1e-2) & (norms > 0)))
+
+def _normalized_bank(data: dict, label: str) -> Optional[np.ndarray]:
+    """
+    Contiguous float32 view of data['<label>_embeddings'] (rows already L2-normalized
+    by _append_examples / save_training_data). Upcast once per embeddings matrix (add_* always assigns
+    a new matrix, which invalidates it), so a query's cosine against the whole bank is one matmul.
+    """
+    matrix = data.get(f'{label}_embeddings')
+    if matrix is None or len(matrix) == 0:
+        return None
+    cache = data.setdefault('_normalized', {})
+    cached = cache.get(label)
+    if cached is None or cached[0] is not matrix:
+        cached = (matrix, np.ascontiguousarray(matrix, dtype=np.float32))
+        cache[label] = cached
+    return cached[1]
+
+def _score_embeddings(embeddings: np.ndarray, data: dict, threshold: float) -> List[Tuple[bool, float, str]]:
+    """
+    Score already-encoded texts (one row each) against the stored positive/negative
+    examples: one matrix product per bank for the whole batch.
+    """
+    queries = _l2_normalize(np.asarray(embeddings, dtype=np.float32))
+    n = len(queries)
+    mismatch = _store_mismatch(data, queries.shape[-1])
+    if mismatch:
+        # Pass everything (as with no training data) until the store is rebuilt for this model
+        return [(True, 0.5, mismatch)] * n
+    
+    # Highest cosine similarity to positive examples
+    pos_similarities = np.zeros(n, dtype=np.float32)
+    positive_bank = _normalized_bank(data, 'positive')
+    if positive_bank is not None:
+        pos_similarities = (queries @ positive_bank.T).max(axis=1)
+    
+    # Highest cosine similarity to negative examples, keeping the index of the closest one
+    neg_similarities = np.zeros(n, dtype=np.float32)
+    closest_negative = None
+    negative_bank = _normalized_bank(data, 'negative')
+    if negative_bank is not None:
+        negative_similarities = queries @ negative_bank.T
+        closest_negative = negative_similarities.argmax(axis=1)
+        neg_similarities = negative_similarities[np.arange(n), closest_negative]
+    
+    return [
+        _verdict(float(pos_similarities[i]), float(neg_similarities[i]),
+                 data['negative_reasons'][closest_negative[i]] if closest_negative is not None else "", threshold)
+        for i in range(n)
+    ]
+
+def _score_embedding(text_embedding: np.ndarray, data: dict, threshold: float) -> Tuple[bool, float, str]:
+    """Score one already-encoded text against the stored positive/negative examples."""
+    return _score_embeddings(np.asarray(text_embedding)[np.newaxis], data, threshold)[0]
+
+def _verdict(pos_similarity: float, neg_similarity: float, most_similar_negative_reason: str,
+             threshold: float) -> Tuple[bool, float, str]:
+    """Turn the best positive/negative similarities into (is_relevant, score, explanation)."""
     # Decision logic
     # New scoring: margin-based (pos - neg) mapped to 0-1
     # This avoids bias from having more negative examples than positive ones.
@@ -185,6 +633,47 @@ def predict_relevance(text: str, threshold: float = 0.65) -> Tuple[bool, float,
     
     return is_relevant, relevance_score, explanation
 
+def predict_relevance(text: str, threshold: float = 0.65) -> Tuple[bool, float, str]:
+    """
+    Predict if an article is relevant using semantic similarity.
+    
+    Returns:
+        Tuple of (is_relevant, confidence, explanation)
+    """
+    model = get_model()
+    if model is None:
+        # Fallback: pass everything if model not available
+        return True, 0.5, "Modelo semántico no disponible"
+    
+    data = load_training_data()
+    verdict = _untrained_verdict(data)
+    if verdict is not None:
+        return verdict
+    
+    # Get embedding for input text
+    text_embedding = encode_text(text)
+    return _score_embedding(text_embedding, data, threshold)
+
+def predict_relevance_batch(texts: list, threshold: float = 0.65) -> list:
+    """
+    Batch version of predict_relevance: encodes all texts in a single
+    model.encode call and returns one (is_relevant, confidence, explanation) per text.
+    """
+    if not texts:
+        return []
+    
+    model = get_model()
+    if model is None:
+        return [(True, 0.5, "Modelo semántico no disponible")] * len(texts)
+    
+    data = load_training_data()
+    verdict = _untrained_verdict(data)
+    if verdict is not None:
+        return [verdict] * len(texts)
+    
+    embeddings = encode_texts(texts)
+    return _score_embeddings(embeddings, data, threshold)
+
 def semantic_pre_filter(content: str, threshold: float = 0.65) -> bool:
     """
     Pre-filter content using semantic similarity.
@@ -208,13 +697,31 @@ def semantic_pre_filter(content: str, threshold: float = 0.65) -> bool:
     
     return True
 
+def semantic_pre_filter_batch(contents: list, threshold: float = 0.65) -> list:
+    """
+    Batch version of semantic_pre_filter. Empty contents are rejected without
+    being encoded; the rest are scored with a single batched encode.
+    
+    Returns:
+        List of booleans aligned with contents (True = send to AI)
+    """
+    verdicts = [False] * len(contents)
+    indexed = [(i, c) for i, c in enumerate(contents) if c]
+    if not indexed:
+        return verdicts
+    
+    results = predict_relevance_batch([c for _, c in indexed], threshold)
+    for (i, _), (is_relevant, score, explanation) in zip(indexed, results):
+        verdicts[i] = is_relevant
+    return verdicts
+
 # Convenience function to get training stats
 def get_training_stats() -> dict:
     """Get statistics about the current training data."""
     data = load_training_data()
     return {
-        'positive_count': len(data.get('positive', [])),
-        'negative_count': len(data.get('negative', [])),
+        'positive_count': len(data['positive_texts']),
+        'negative_count': len(data['negative_texts']),
         'model_loaded': get_model() is not None
     }
 
@@ -223,7 +730,7 @@ def batch_filter_articles(articles: list, threshold: float = 0.65, min_pass: int
     Filter a batch of articles, guaranteeing at least min_pass articles pass.
     
     Args:
-        articles: List of dicts with 'content' key (and other metadata)
+        articles: List of dicts with 'content' key, or objects with a .content attribute (e.g. agent.Item)
         threshold: Relevance score threshold for passing
         min_pass: Minimum number of articles to always pass (top scorers)
     
@@ -238,15 +745,22 @@ def batch_filter_articles(articles: list, threshold: float = 0.65, min_pass: int
         # No model: pass all
         return [(a, 0.5, True, "Modelo no disponible") for a in articles]
     
-    # Score all articles
-    scored = []
+    # Score all articles: one batched encode + one matrix product per bank
+    contents = []
     for article in articles:
-        content = article.get('content', '') or article.get('headline', '')
+        if isinstance(article, dict):
+            contents.append(article.get('content', '') or article.get('headline', ''))
+        else:
+            contents.append(getattr(article, 'content', '') or getattr(article, 'headline', ''))
+    results = iter(predict_relevance_batch([content for content in contents if content], threshold))
+    
+    scored = []
+    for article, content in zip(articles, contents):
         if not content:
             scored.append((article, 0.0, False, "Sin contenido"))
             continue
         
-        is_relevant, score, explanation = predict_relevance(content, threshold)
+        is_relevant, score, explanation = next(results)
         scored.append((article, score, is_relevant, explanation))
     
     # Sort by score descending
@@ -1,47 +1,132 @@
 import os
+import ssl
 import json
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+try:
+    import orjson  # Opcional: parseo JSON más rápido
+except ImportError:
+    orjson = None
 
-def send_slack_notification(analysis_json_str, source_url, country=None):
+# Canales por región (Hardcoded según solicitud del usuario)
+CHANNELS = {
+    'es': 'C0A35QRSH8Q',  # Spain
+    'pt': 'C0A2F3BPSUC',  # Portugal/Brazil
+    'br': 'C0A2F3BPSUC',  # Portugal/Brazil
+    'mx': 'C0A29EHE5U6',  # Mexico
+    'pe': 'C0A254D9RQT',  # Peru/Chile/Colombia
+    'cl': 'C0A254D9RQT',  # Peru/Chile/Colombia
+    'co': 'C0A254D9RQT',  # Peru/Chile/Colombia
+    'gt': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
+    'ar': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
+    'ec': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
+    'py': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
+    'uy': 'C0A29EXJ8RL'   # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
+}
+
+# Mapeo de nombres completos a códigos de 2 letras
+COUNTRY_ALIASES = {
+    'spain': 'es', 'españa': 'es', 'espana': 'es',
+    'portugal': 'pt',
+    'brazil': 'br', 'brasil': 'br',
+    'mexico': 'mx', 'méxico': 'mx',
+    'peru': 'pe', 'perú': 'pe',
+    'chile': 'cl',
+    'colombia': 'co',
+    'guatemala': 'gt',
+    'argentina': 'ar',
+    'ecuador': 'ec',
+    'paraguay': 'py',
+    'uruguay': 'uy'
+}
+
+# Un solo cliente por proceso: reutiliza el contexto SSL (certificados CA cargados una vez)
+_client = None
+
+def _get_client(slack_token):
+    """Devuelve el WebClient compartido, creándolo en la primera notificación."""
+    global _client
+    if _client is None or _client.token != slack_token:
+        _client = WebClient(token=slack_token, timeout=10, ssl=ssl.create_default_context())
+    return _client
+
+def _build_blocks(company_name, opportunity_summary, igeneris_fit, proposed_solution,
+                  value_proposition, source_url, country):
+    """Bloques de Slack (formato rico) de una oportunidad."""
+    return [
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": f"🚀 Nueva Oportunidad Identificada: {company_name}",
+                "emoji": True
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Oportunidad:*\n{opportunity_summary}"
+            }
+        },
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"*Fuente:* <{source_url}|Link al Artículo> | *País:* {country.upper() if country else 'N/A'}"
+                }
+            ]
+        },
+        {"type": "divider"},
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"🔹 *Igeneris Fit (Nuestro Ángulo):*\n{igeneris_fit}"
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": f"🔹 *Nuestra Propuesta de Solución:*\n{proposed_solution}"
+                }
+            ]
+        },
+        {"type": "divider"},
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Propuesta de Valor:*\n_{value_proposition}_"
+            }
+        },
+        {"type": "divider"},
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "✍️ Añadir Feedback",
+                        "emoji": True
+                    },
+                    "style": "primary",
+                    "value": source_url,
+                    "action_id": "open_feedback_modal"
+                }
+            ]
+        }
+    ]
+
+def send_slack_notification(analysis_json_str=None, source_url=None, country=None, analysis=None):
     """
     Formatea y envía una notificación a Slack al canal correspondiente según la región.
+    Si el llamador ya tiene el análisis como dict lo pasa en `analysis` y se evita
+    volver a parsear `analysis_json_str`.
     """
     slack_token = os.environ.get("SLACK_BOT_TOKEN")
-    client = WebClient(token=slack_token)
     
-    # Canales por región (Hardcoded según solicitud del usuario)
-    CHANNELS = {
-        'es': 'C0A35QRSH8Q',  # Spain
-        'pt': 'C0A2F3BPSUC',  # Portugal/Brazil
-        'br': 'C0A2F3BPSUC',  # Portugal/Brazil
-        'mx': 'C0A29EHE5U6',  # Mexico
-        'pe': 'C0A254D9RQT',  # Peru/Chile/Colombia
-        'cl': 'C0A254D9RQT',  # Peru/Chile/Colombia
-        'co': 'C0A254D9RQT',  # Peru/Chile/Colombia
-        'gt': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
-        'ar': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
-        'ec': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
-        'py': 'C0A29EXJ8RL',  # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
-        'uy': 'C0A29EXJ8RL'   # Guatemala/Argentina/Ecuador/Paraguay/Uruguay
-    }
-    
-    # Mapeo de nombres completos a códigos de 2 letras
-    COUNTRY_ALIASES = {
-        'spain': 'es', 'españa': 'es', 'espana': 'es',
-        'portugal': 'pt',
-        'brazil': 'br', 'brasil': 'br',
-        'mexico': 'mx', 'méxico': 'mx',
-        'peru': 'pe', 'perú': 'pe',
-        'chile': 'cl',
-        'colombia': 'co',
-        'guatemala': 'gt',
-        'argentina': 'ar',
-        'ecuador': 'ec',
-        'paraguay': 'py',
-        'uruguay': 'uy'
-    }
-
     # Determinar el canal. Primero normalizar el país a código de 2 letras.
     country_key = country.lower() if country else None
     if country_key and country_key not in CHANNELS:
@@ -52,6 +137,7 @@ def send_slack_notification(analysis_json_str, source_url, country=None):
     if not slack_token:
         print("Error: Falta la variable de entorno SLACK_BOT_TOKEN.")
         return False
+    client = _get_client(slack_token)
         
     if not channel_id:
          print(f"Error: No se pudo determinar un canal para el país '{country}' (Key: '{country_key}') y no hay fallback.")
@@ -59,7 +145,8 @@ def send_slack_notification(analysis_json_str, source_url, country=None):
 
 
     try:
-        analysis = json.loads(analysis_json_str)
+        if analysis is None:
+            analysis = orjson.loads(analysis_json_str) if orjson else json.loads(analysis_json_str)
         company_name = analysis.get("company_name", "")
         opportunity_summary = analysis.get("opportunity_summary", "")
         igeneris_fit = analysis.get("igeneris_fit", "")
@@ -78,71 +165,8 @@ def send_slack_notification(analysis_json_str, source_url, country=None):
             print(f"Error: Datos incompletos para formato rico. Campos vacíos: {missing}", flush=True)
             return False  # NO enviar nada si los datos están incompletos
         
-        blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"🚀 Nueva Oportunidad Identificada: {company_name}",
-                    "emoji": True
-                }
-            },
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Oportunidad:*\n{opportunity_summary}"
-                }
-            },
-            {
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"*Fuente:* <{source_url}|Link al Artículo> | *País:* {country.upper() if country else 'N/A'}"
-                    }
-                ]
-            },
-            {"type": "divider"},
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"🔹 *Igeneris Fit (Nuestro Ángulo):*\n{igeneris_fit}"
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": f"🔹 *Nuestra Propuesta de Solución:*\n{proposed_solution}"
-                    }
-                ]
-            },
-            {"type": "divider"},
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*Propuesta de Valor:*\n_{value_proposition}_"
-                }
-            },
-            {"type": "divider"},
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "✍️ Añadir Feedback",
-                            "emoji": True
-                        },
-                        "style": "primary",
-                        "value": source_url,
-                        "action_id": "open_feedback_modal"
-                    }
-                ]
-            }
-        ]
+        blocks = _build_blocks(company_name, opportunity_summary, igeneris_fit, proposed_solution,
+                               value_proposition, source_url, country)
 
         fallback_text = f"Nueva Oportunidad: {company_name} - {opportunity_summary} (Fuente: {source_url})"
 
@@ -1,109 +1,138 @@
 import sqlite3
-import pickle
 import os
+import joblib
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 
 # Configuration
 DB_PATH = 'opportunities.db'
-MODEL_FILE = 'filter_model.pkl'
+MODEL_FILE = 'filter_model.joblib'  # Loaded by agent.load_ml_model with mmap_mode='r'
+HASH_FEATURES = 2 ** 18  # Hashed (unigram + bigram) feature space; no vocabulary to fit or store
+CHUNK_SIZE = 5000  # Rows read (and fed to partial_fit) at a time
+TEST_FRACTION = 0.2  # Share of each chunk held out for the evaluation report
 
-def get_training_data():
-    """Fetches labeled data from the database."""
+# Fetch Relevant items (status='relevant') AND Notified items (status='notified')
+# Strategy Update: User requested to treat 'notified' items as 'relevant' initially 
+# to avoid a restrictive model due to lack of explicit positive labels.
+LABELED_STATUSES = "('relevant', 'irrelevant', 'notified')"
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH)
+    # Let the OS page cache serve the table scan (mmap) and give SQLite a bigger page cache
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
+
+def get_label_counts():
+    """Number of labeled rows per status (an aggregate, without reading the texts)."""
     if not os.path.exists(DB_PATH):
         print(f"Database not found at {DB_PATH}")
-        return pd.DataFrame()
+        return {}
 
-    conn = sqlite3.connect(DB_PATH)
-    
-    # Fetch Relevant items (status='relevant') AND Notified items (status='notified')
-    # Strategy Update: User requested to treat 'notified' items as 'relevant' initially 
-    # to avoid a restrictive model due to lack of explicit positive labels.
-    
-    query = """
-        SELECT headline, content, status 
-        FROM opportunities 
-        WHERE status IN ('relevant', 'irrelevant', 'notified')
-    """
-    
+    conn = _connect()
     try:
-        df = pd.read_sql_query(query, conn)
-        return df
+        return dict(conn.execute(
+            f"SELECT status, COUNT(*) FROM opportunities WHERE status IN {LABELED_STATUSES} GROUP BY status"
+        ).fetchall())
     except Exception as e:
         print(f"Error reading database: {e}")
-        return pd.DataFrame()
+        return {}
+    finally:
+        conn.close()
+
+def get_training_data():
+    """
+    Yields the labeled data from the database in DataFrames of CHUNK_SIZE rows
+    (columns full_text, status), so the whole table is never held in memory.
+    """
+    # We combine headline and content for richer features, or just use headline if content is empty
+    query = f"""
+        SELECT COALESCE(headline, '') || ' ' || COALESCE(content, '') AS full_text, status 
+        FROM opportunities 
+        WHERE status IN {LABELED_STATUSES}
+    """
+
+    conn = _connect()
+    try:
+        yield from pd.read_sql_query(query, conn, chunksize=CHUNK_SIZE)
     finally:
         conn.close()
 
 def train():
     print("Loading data from database...")
-    df = get_training_data()
+    counts = get_label_counts()
     
-    if df.empty:
+    if not counts:
         print("No training data found (no items with status 'relevant' or 'irrelevant').")
         print("Please use the agent and provide feedback via Slack to build a dataset.")
         return
 
-    print(f"Found {len(df)} labeled examples.")
-    print(df['status'].value_counts())
+    print(f"Found {sum(counts.values())} labeled examples.")
+    for status, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {status}: {count}")
 
-    # Prepare data
-    # We combine headline and content for richer features, or just use headline if content is empty
-    df['full_text'] = df['headline'].fillna('') + " " + df['content'].fillna('')
-    
-    X = df['full_text']
-    X = df['full_text']
     # Labeling: 'irrelevant' -> 0, Everything else ('relevant', 'notified') -> 1
-    y = df['status'].apply(lambda x: 0 if x == 'irrelevant' else 1)
-    
-    # Remove rows where mapping failed (if any other status crept in)
-    X = X[y.notna()]
-    y = y[y.notna()]
+    class_counts = {0: counts.get('irrelevant', 0), 1: counts.get('relevant', 0) + counts.get('notified', 0)}
 
-    if len(y) < 5:
+    if sum(class_counts.values()) < 5:
         print("Not enough data to train (need at least 5 examples per class ideally).")
         return
 
     # CHECK FOR CLASS IMBALANCE (CRITICAL)
-    unique_classes = y.unique()
-    if len(unique_classes) < 2:
-        print(f"\n⚠️ CRITICAL WARNING: Only found one class of data ({unique_classes[0]}).")
+    present_classes = [label for label, count in class_counts.items() if count]
+    if len(present_classes) < 2:
+        print(f"\n⚠️ CRITICAL WARNING: Only found one class of data ({present_classes[0]}).")
         print("You have 'Irrelevant' examples but ZERO 'Relevant' examples (or vice versa).")
         print("The model cannot learn to distinguish if it hasn't seen both types.")
         print(">> ACTION REQUIRED: Please go to Slack/App and mark at least 1-2 items as 'Relevant'.")
         print(">> Model was NOT saved to prevent blocking all content.")
         return
 
-    # Split (Optional, good for validation output)
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    # Define Pipeline
-    # CountVectorizer: Converts text to token counts (Bag of Words)
+    # HashingVectorizer: stateless token counts (Bag of Words) hashed into HASH_FEATURES columns;
+    #   alternate_sign=False keeps counts non-negative, as MultinomialNB requires
     # MultinomialNB: Naive Bayes classifier suitable for word counts
-    text_clf = Pipeline([
-        ('vect', CountVectorizer(stop_words='english')), # Basic English stop words
-        ('clf', MultinomialNB()),
-    ])
+    vect = HashingVectorizer(n_features=HASH_FEATURES, alternate_sign=False,
+                             ngram_range=(1, 2), stop_words='english') # Basic English stop words
+    clf = MultinomialNB()
 
+    # Split (Optional, good for validation output): hold out TEST_FRACTION of every chunk
     print("Training model...")
-    text_clf.fit(X_train, y_train)
+    rng = np.random.default_rng(42)
+    held_out = []
+    for chunk in get_training_data():
+        X = vect.transform(chunk['full_text'])
+        y = (chunk['status'] != 'irrelevant').astype(int).to_numpy()
+        test_mask = rng.random(len(y)) < TEST_FRACTION
+        if (~test_mask).any():
+            clf.partial_fit(X[~test_mask], y[~test_mask], classes=[0, 1])
+        if test_mask.any():
+            held_out.append((X[test_mask], y[test_mask]))
 
     # Validate
-    predictions = text_clf.predict(X_test)
-    print("\nModel Evaluation:")
-    print(f"Accuracy: {accuracy_score(y_test, predictions):.2f}")
+    if held_out:
+        y_test = np.concatenate([y for _, y in held_out])
+        predictions = np.concatenate([clf.predict(X) for X, _ in held_out])
+        print("\nModel Evaluation:")
+        print(f"Accuracy: {accuracy_score(y_test, predictions):.2f}")
     
-    # Train on FULL dataset before saving
+    # Train on FULL dataset before saving: Naive Bayes counts are additive, so adding
+    # the held-out rows gives exactly the model fitted on every row
     print("Retraining on full dataset...")
-    text_clf.fit(X, y)
+    for X, y in held_out:
+        clf.partial_fit(X, y, classes=[0, 1])
+
+    # Same vect -> clf Pipeline the agent expects (agent.unpack_nb_model)
+    text_clf = Pipeline([
+        ('vect', vect),
+        ('clf', clf),
+    ])
 
-    # Save
-    with open(MODEL_FILE, 'wb') as f:
-        pickle.dump(text_clf, f)
+    # Save (uncompressed so the arrays can be memory-mapped on load)
+    joblib.dump(text_clf, MODEL_FILE)
     
     print(f"Model saved to {MODEL_FILE}")
 
@@ -4,12 +4,12 @@ Verification script for Semantic Filter Upgrade
 import time
 # Wait for imports to be available if running immediately after install
 try:
-    from semantic_filter import predict_relevance, get_model, SENTENCE_TRANSFORMER_MODEL
+    from semantic_filter import predict_relevance_batch, get_model, SENTENCE_TRANSFORMER_MODEL
 except ImportError:
     print("Waiting for dependencies...")
     import time
     time.sleep(5)
-    from semantic_filter import predict_relevance, get_model, SENTENCE_TRANSFORMER_MODEL
+    from semantic_filter import predict_relevance_batch, get_model, SENTENCE_TRANSFORMER_MODEL
 
 def verify():
     print("="*60)
@@ -39,19 +39,19 @@ def verify():
     En el amor, todo parece indicar que habrá sorpresas.
     """
     
-    print("\n--- TEST CASE A: Relevant Spanish Article ---")
-    is_rel, score, reason = predict_relevance(relevant_text, threshold=0.50)
-    print(f"Text: {relevant_text.strip()[:100]}...")
-    print(f"Score: {score:.4f}")
-    print(f"Passed: {is_rel}")
-    print(f"Reason: {reason}")
+    cases = [
+        ("TEST CASE A: Relevant Spanish Article", relevant_text),
+        ("TEST CASE B: Irrelevant Spanish Article", irrelevant_text),
+    ]
+    # Both texts scored with a single batched encode
+    results = predict_relevance_batch([text for _, text in cases], threshold=0.50)
     
-    print("\n--- TEST CASE B: Irrelevant Spanish Article ---")
-    is_rel, score, reason = predict_relevance(irrelevant_text, threshold=0.50)
-    print(f"Text: {irrelevant_text.strip()[:100]}...")
-    print(f"Score: {score:.4f}")
-    print(f"Passed: {is_rel}")
-    print(f"Reason: {reason}")
+    for (title, text), (is_rel, score, reason) in zip(cases, results):
+        print(f"\n--- {title} ---")
+        print(f"Text: {text.strip()[:100]}...")
+        print(f"Score: {score:.4f}")
+        print(f"Passed: {is_rel}")
+        print(f"Reason: {reason}")
 
 if __name__ == "__main__":
     verify()
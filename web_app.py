@@ -12,13 +12,51 @@ import os
 import json
 import sqlite3
 import csv
+import time
+import queue
+import sys
+import atexit
+import logging
+import logging.handlers
+import threading
 from flask import Flask, request, jsonify
 from slack_sdk import WebClient
 from dotenv import load_dotenv
+try:
+    import orjson  # Optional: faster parsing of Slack payloads
+except ImportError:
+    orjson = None
 
 # Load environment variables
 load_dotenv()
 
+def _threads_run(timeout=1.0):
+    """
+    True if a thread started by the app actually runs. Under uWSGI without
+    --enable-threads (e.g. PythonAnywhere) it doesn't, so nothing may depend on one.
+    """
+    ran = threading.Event()
+    threading.Thread(target=ran.set, name="thread-probe", daemon=True).start()
+    return ran.wait(timeout)
+
+THREADS_AVAILABLE = _threads_run()
+
+# --- Logging ---
+log = logging.getLogger("web_app")
+log.setLevel(logging.INFO)
+log.propagate = False
+_stdout_handler = logging.StreamHandler(sys.stdout)
+_stdout_handler.setFormatter(logging.Formatter("%(message)s"))
+if THREADS_AVAILABLE:
+    # Handlers only enqueue; formatting and the stdout write happen on the listener's thread
+    _log_queue = queue.SimpleQueue()
+    log.addHandler(logging.handlers.QueueHandler(_log_queue))
+    _log_listener = logging.handlers.QueueListener(_log_queue, _stdout_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)  # Registered first, so it runs last and drains every message
+else:
+    log.addHandler(_stdout_handler)  # No background threads: write directly
+
 # --- Configuration ---
 app = Flask(__name__)
 
@@ -39,6 +77,7 @@ V2_CHANNEL_IDS = [
 env_v2_channels = os.environ.get("SLACK_CHANNEL_IDS_V2", "")
 if env_v2_channels:
     V2_CHANNEL_IDS = [ch.strip() for ch in env_v2_channels.split(",") if ch.strip()]
+V2_CHANNEL_SET = frozenset(V2_CHANNEL_IDS)  # Membership test per request; the list keeps display order
 
 # File paths
 DB_NAME_V2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opportunities.db')
@@ -46,77 +85,170 @@ DB_NAME_V2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opportuni
 # Validate required config
 if not SLACK_BOT_TOKEN:
     # Warning only, so app doesn't crash on import if env not loaded yet
-    print("Warning: SLACK_BOT_TOKEN not found in environment", flush=True)
+    log.warning("Warning: SLACK_BOT_TOKEN not found in environment")
 
-print(f"Feedback Handler initialized:", flush=True)
-print(f"Feedback Handler initialized:", flush=True)
-print(f"  V2 Channels: {V2_CHANNEL_IDS}", flush=True)
-print(f"  V2 Database: {DB_NAME_V2}", flush=True)
+log.info("Feedback Handler initialized:")
+log.info(f"  V2 Channels: {V2_CHANNEL_IDS}")
+log.info(f"  V2 Database: {DB_NAME_V2}")
 
 
 # --- Database Functions ---
-def log_feedback_to_db_v2(url, feedback, rationale):
-    """Save feedback to hunter-agentv2 SQLite database."""
-    try:
-        conn = sqlite3.connect(DB_NAME_V2)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE opportunities SET status = ?, feedback_rationale = ? WHERE source_url = ?",
-            (feedback, rationale, url)
-        )
-        conn.commit()
-        rows_affected = cursor.rowcount
-        conn.close()
-        
-        if rows_affected > 0:
-            print(f"✅ Feedback V2 guardado para {url}", flush=True)
+# One long-lived connection shared by the request threads (opened on first feedback)
+_db_conn = None
+_db_lock = threading.Lock()
+
+def _get_db_conn():
+    """Shared V2 connection; call with _db_lock held."""
+    global _db_conn
+    if _db_conn is None:
+        conn = sqlite3.connect(DB_NAME_V2, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")  # The agent can keep reading while feedback is written
+        conn.execute("PRAGMA synchronous=NORMAL")  # No fsync per commit in WAL mode
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB: read pages via mmap instead of read()
+        _db_conn = conn
+    return _db_conn
+
+# Feedback is queued by the request handlers and written in batches, one transaction per flush
+FEEDBACK_FLUSH_INTERVAL = 0.2  # seconds
+FEEDBACK_MAX_BACKOFF = 60  # seconds between retries while the DB keeps failing
+FEEDBACK_SYNC_THRESHOLD = 20  # Queued feedbacks at which the request thread flushes inline
+# Last resort if feedback still can't be written at shutdown (Slack already got its 200)
+FEEDBACK_FALLBACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feedback_unsaved.jsonl')
+_feedback_queue = queue.Queue()
+_feedback_retry = []  # Batch whose write failed; retried first on the next flush
+
+def flush_feedback_v2():
+    """
+    Write every queued (url, feedback, rationale) in a single transaction.
+    Returns False if the write failed; the batch is kept and retried on the next flush.
+    """
+    global _db_conn
+    with _db_lock:
+        batch = _feedback_retry[:]
+        _feedback_retry.clear()
+        while True:
+            try:
+                batch.append(_feedback_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return True
+        try:
+            conn = _get_db_conn()
+            with conn:  # Commits, or rolls back the whole batch if an UPDATE fails
+                found = [
+                    conn.execute(
+                        "UPDATE opportunities SET status = ?, feedback_rationale = ? WHERE source_url = ?",
+                        (feedback, rationale, url)
+                    ).rowcount > 0
+                    for url, feedback, rationale in batch
+                ]
+        except Exception as e:
+            log.error(f"❌ ERROR al escribir en la BD V2 ({len(batch)} feedbacks, se reintentará): {e}")
+            _feedback_retry.extend(batch)
+            if _db_conn is not None:
+                _db_conn.close()  # Reconnect on the next attempt
+                _db_conn = None
+            return False
+    
+    for (url, _, _), ok in zip(batch, found):
+        if ok:
+            log.info(f"✅ Feedback V2 guardado para {url}")
         else:
-            print(f"⚠️ URL no encontrada en BD: {url}", flush=True)
-        return rows_affected > 0
-    except Exception as e:
-        print(f"❌ ERROR al escribir en la BD V2: {e}", flush=True)
-        return False
+            log.warning(f"⚠️ URL no encontrada en BD: {url}")
+    return True
+
+_writer_heartbeat = None  # time.monotonic() of the writer thread's last loop; None until it runs
+
+def _writer_alive():
+    """True if the background writer is running (started, and has looped recently)."""
+    return (_writer_thread is not None and _writer_thread.is_alive() and _writer_heartbeat is not None
+            and time.monotonic() - _writer_heartbeat < FEEDBACK_MAX_BACKOFF + 5)
+
+def _feedback_writer():
+    global _writer_heartbeat
+    delay = FEEDBACK_FLUSH_INTERVAL
+    while True:
+        _writer_heartbeat = time.monotonic()
+        time.sleep(delay)
+        # Exponential backoff while writes fail, back to the normal interval once one succeeds
+        delay = FEEDBACK_FLUSH_INTERVAL if flush_feedback_v2() else min(delay * 2, FEEDBACK_MAX_BACKOFF)
+
+def _flush_feedback_at_exit():
+    """Final flush; whatever still can't be written is appended to FEEDBACK_FALLBACK_PATH."""
+    if flush_feedback_v2():
+        return
+    with _db_lock:
+        try:
+            with open(FEEDBACK_FALLBACK_PATH, 'a', encoding='utf-8') as f:
+                for url, feedback, rationale in _feedback_retry:
+                    f.write(json.dumps({'source_url': url, 'status': feedback, 'feedback_rationale': rationale},
+                                       ensure_ascii=False) + '\n')
+            log.error(f"❌ {len(_feedback_retry)} feedbacks sin guardar escritos en {FEEDBACK_FALLBACK_PATH}")
+            _feedback_retry.clear()
+        except OSError as e:
+            log.error(f"❌ No se pudo escribir {FEEDBACK_FALLBACK_PATH}: {e}")
+
+_writer_thread = None
+if THREADS_AVAILABLE:
+    _writer_thread = threading.Thread(target=_feedback_writer, name="feedback-writer", daemon=True)
+    _writer_thread.start()
+atexit.register(_flush_feedback_at_exit)  # Best effort: uWSGI may stop workers without running atexit
+
+def log_feedback_to_db_v2(url, feedback, rationale):
+    """
+    Queue feedback for the hunter-agentv2 SQLite database. The background writer
+    batches it (within FEEDBACK_FLUSH_INTERVAL); if the writer isn't running, or
+    the queue has grown past FEEDBACK_SYNC_THRESHOLD, it is written inline.
+    """
+    _feedback_queue.put((url, feedback, rationale))
+    if not _writer_alive() or _feedback_queue.qsize() >= FEEDBACK_SYNC_THRESHOLD:
+        flush_feedback_v2()
 
 
 
 
 
 # --- Slack Modal Definition ---
+# Fixed part of the feedback modal, built once; only private_metadata (the URL) changes per click
+_FEEDBACK_MODAL = {
+    "type": "modal",
+    "callback_id": "feedback_submission_v2",
+    "title": {"type": "plain_text", "text": "Añadir Feedback"},
+    "submit": {"type": "plain_text", "text": "Enviar"},
+    "blocks": [
+        {
+            "type": "input",
+            "block_id": "status_block",
+            "label": {"type": "plain_text", "text": "Calificación"},
+            "element": {
+                "type": "radio_buttons",
+                "action_id": "status_input",
+                "options": [
+                    {"text": {"type": "plain_text", "text": "✅ Relevante"}, "value": "relevant"},
+                    {"text": {"type": "plain_text", "text": "❌ No Relevante"}, "value": "irrelevant"}
+                ]
+            }
+        },
+        {
+            "type": "input",
+            "block_id": "rationale_block",
+            "label": {"type": "plain_text", "text": "Justificación (Opcional)"},
+            "element": {
+                "type": "plain_text_input",
+                "action_id": "rationale_input",
+                "multiline": True
+            },
+            "optional": True
+        }
+    ]
+}
+
 def get_feedback_modal(source_url):
     """Returns the Slack modal view for feedback submission."""
-    return {
-        "type": "modal",
-        "callback_id": "feedback_submission_v2",
-        "title": {"type": "plain_text", "text": "Añadir Feedback"},
-        "submit": {"type": "plain_text", "text": "Enviar"},
-        "private_metadata": source_url,
-        "blocks": [
-            {
-                "type": "input",
-                "block_id": "status_block",
-                "label": {"type": "plain_text", "text": "Calificación"},
-                "element": {
-                    "type": "radio_buttons",
-                    "action_id": "status_input",
-                    "options": [
-                        {"text": {"type": "plain_text", "text": "✅ Relevante"}, "value": "relevant"},
-                        {"text": {"type": "plain_text", "text": "❌ No Relevante"}, "value": "irrelevant"}
-                    ]
-                }
-            },
-            {
-                "type": "input",
-                "block_id": "rationale_block",
-                "label": {"type": "plain_text", "text": "Justificación (Opcional)"},
-                "element": {
-                    "type": "plain_text_input",
-                    "action_id": "rationale_input",
-                    "multiline": True
-                },
-                "optional": True
-            }
-        ]
-    }
+    return {**_FEEDBACK_MODAL, "private_metadata": source_url}
 
 
 # --- Main Route ---
@@ -126,58 +258,56 @@ def handle_all_feedback():
     Unified endpoint for all Slack interactions.
     Routes to V1 or V2 handler based on channel ID.
     """
+    # Slack retry of a request we already received: acknowledge without processing it again
+    if request.headers.get('X-Slack-Retry-Num'):
+        return "", 200
+
     payload_str = request.form.get('payload')
     if not payload_str:
+        # URL verification when the endpoint is registered (JSON body, not a form payload)
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get('type') == 'url_verification':
+            return jsonify({'challenge': body.get('challenge')})
         return jsonify({'error': 'No payload'}), 400
 
     try:
-        payload = json.loads(payload_str)
+        payload = orjson.loads(payload_str) if orjson else json.loads(payload_str)
     except json.JSONDecodeError:
         return jsonify({'error': 'Invalid JSON'}), 400
-
-    # Determine channel ID from payload
-    channel_id = None
-    
-    # For button clicks, channel is in payload
-    if payload.get('channel'):
-        channel_id = payload.get('channel', {}).get('id')
-    
-    # For modal submissions, check callback_id
-    if payload.get('type') == 'view_submission':
-        callback_id = payload.get('view', {}).get('callback_id', '')
-        if callback_id == 'feedback_submission_v2':
-            # V2 modal submission - handle directly
-            return handle_v2_modal_submission(payload)
-        elif callback_id == 'feedback_submission':
-            # Legacy callback_id - also V2
-            return handle_v2_modal_submission(payload)
-
-    # Route based on Action ID (Prioritize V2 'open_feedback_modal')
-    # This ensures that even if a message is in a "V1" channel, 
-    # if it has the V2 button, it gets the V2 modal behavior.
-    if payload.get('type') == 'block_actions':
-        action_id = payload.get('actions', [{}])[0].get('action_id')
-        if action_id == 'open_feedback_modal':
-            return handle_v2_interaction(payload)
-
-    # Fallback: Route based on channel
-    if channel_id in V2_CHANNEL_IDS:
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Invalid payload'}), 400
+
+    # Route on (type, callback_id) for modal submissions, (type, action_id) for button clicks
+    payload_type = payload.get('type')
+    route_id = None
+    if payload_type == 'view_submission':
+        route_id = (payload.get('view') or {}).get('callback_id')
+    elif payload_type == 'block_actions':
+        actions = payload.get('actions')
+        route_id = actions[0].get('action_id') if actions else None
+    handler = ROUTES.get((payload_type, route_id))
+    if handler is not None:
+        return handler(payload)
+
+    # Fallback: Route based on channel (button clicks carry it in the payload)
+    channel_id = (payload.get('channel') or {}).get('id')
+    if channel_id in V2_CHANNEL_SET:
         return handle_v2_interaction(payload)
     else:
-        print(f"⚠️ Canal no reconocido: {channel_id} - Usando V2 por defecto", flush=True)
+        log.warning(f"⚠️ Canal no reconocido: {channel_id} - Usando V2 por defecto")
         # Default to V2 behavior for unknown channels
         return handle_v2_interaction(payload)
 
 
 def handle_v2_interaction(payload):
     """Handle V2 button clicks - open feedback modal."""
-    print("📥 Petición recibida para Agente V2", flush=True)
+    log.info("📥 Petición recibida para Agente V2")
     
-    if payload.get('type') == 'block_actions':
-        action = payload.get('actions', [{}])[0]
-        action_id = action.get('action_id', '')
+    actions = payload.get('actions')
+    if payload.get('type') == 'block_actions' and actions:
+        action = actions[0]
         
-        if action_id == 'open_feedback_modal':
+        if action.get('action_id') == 'open_feedback_modal':
             trigger_id = payload['trigger_id']
             source_url = action.get('value', '')
             
@@ -188,7 +318,7 @@ def handle_v2_interaction(payload):
                 )
                 return "", 200
             except Exception as e:
-                print(f"❌ Error abriendo modal: {e}", flush=True)
+                log.error(f"❌ Error abriendo modal: {e}")
                 return "Error opening modal", 500
     
     return "Acción V2 no reconocida", 200
@@ -196,7 +326,7 @@ def handle_v2_interaction(payload):
 
 def handle_v2_modal_submission(payload):
     """Handle V2 modal form submission."""
-    print("📥 Modal V2 enviado", flush=True)
+    log.info("📥 Modal V2 enviado")
     
     try:
         view_state = payload['view']['state']['values']
@@ -207,24 +337,38 @@ def handle_v2_modal_submission(payload):
         log_feedback_to_db_v2(source_url, status, rationale)
         return "", 200
     except Exception as e:
-        print(f"❌ Error procesando modal V2: {e}", flush=True)
+        log.error(f"❌ Error procesando modal V2: {e}")
         return "", 200  # Return 200 to avoid Slack error message
 
 
 
 
 
+# Known interactions -> handler. The V2 'open_feedback_modal' button is routed here before the
+# channel fallback, so even a message in a "V1" channel gets the V2 modal behavior.
+ROUTES = {
+    ('view_submission', 'feedback_submission_v2'): handle_v2_modal_submission,
+    ('view_submission', 'feedback_submission'): handle_v2_modal_submission,  # Legacy callback_id - also V2
+    ('block_actions', 'open_feedback_modal'): handle_v2_interaction,
+}
+
+
 # --- Health Check ---
+# Constant response body, serialized once at startup
+_HEALTH_BODY = json.dumps({
+    'status': 'healthy',
+    'v2_channels': V2_CHANNEL_IDS,
+    'db_path': DB_NAME_V2
+})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring."""
-    return jsonify({
-        'status': 'healthy',
-        'v2_channels': V2_CHANNEL_IDS,
-        'db_path': DB_NAME_V2
-    })
+    return app.response_class(_HEALTH_BODY, mimetype='application/json')
 
 
 if __name__ == '__main__':
+    # Local/dev only. In production a WSGI server imports web_app:app (PythonAnywhere's web tab,
+    # or e.g. `gunicorn -k gthread -w 2 --threads 16 web_app:app`) so views_open calls don't queue up
     port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
+    app.run(host='0.0.0.0', port=port, threaded=True)